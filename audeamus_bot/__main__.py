@@ -1,17 +1,61 @@
 import os
 
-import discord
 from dotenv import load_dotenv
 
 from audeamus_bot import AudeamusBot
 
 load_dotenv()
 
-team_number = int(input("Enter your FRC team number: "))
-guild_id = int(input("Enter your Discord guild ID: "))
-guild = discord.Object(guild_id)
+# The team used by servers that have not set their own with /frc setup
+TEAM_NUMBER = os.getenv("TEAM_NUMBER")
+team_number = int(TEAM_NUMBER) if TEAM_NUMBER is not None else None
 
-client = AudeamusBot(team_number, guild)
+# Optionally keep the team's active event warm in the cache
+prefetch = os.getenv("PREFETCH", "").lower() in ("1", "true", "yes")
+
+# Optionally receive TBA webhooks to update the cache as soon as data changes
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+if WEBHOOK_SECRET is not None:
+    webhook_options = {"secret": WEBHOOK_SECRET, "port": int(os.getenv("WEBHOOK_PORT", "8080"))}
+else:
+    webhook_options = None
+
+# Optionally serve metrics for Prometheus
+METRICS_PORT = os.getenv("METRICS_PORT")
+metrics_port = int(METRICS_PORT) if METRICS_PORT is not None else None
+
+# Optionally run only some of the shards, e.g. one process per group of shards
+shard_options = {}
+SHARD_COUNT = os.getenv("SHARD_COUNT")
+SHARD_IDS = os.getenv("SHARD_IDS")
+if SHARD_COUNT is not None:
+    shard_options["shard_count"] = int(SHARD_COUNT)
+    if SHARD_IDS is not None:
+        shard_options["shard_ids"] = [int(shard_id) for shard_id in SHARD_IDS.split(",")]
+
+# Processes sharing the cache coordinate their requests to TBA
+tba_options = {}
+TBA_REQUESTS_PER_SECOND = os.getenv("TBA_REQUESTS_PER_SECOND")
+if SHARD_IDS is not None or TBA_REQUESTS_PER_SECOND is not None:
+    tba_options["coordinator_options"] = {}
+    if TBA_REQUESTS_PER_SECOND is not None:
+        tba_options["coordinator_options"]["requests_per_second"] = float(TBA_REQUESTS_PER_SECOND)
+
+# Optionally keep matches in memory in a compact columnar form
+if os.getenv("COMPACT_MATCHES", "").lower() in ("1", "true", "yes"):
+    tba_options["compact_matches"] = True
+
+# Optionally check TBA responses against the expected types; needs msgspec
+if os.getenv("VALIDATE_RESPONSES", "").lower() in ("1", "true", "yes"):
+    tba_options["validate"] = True
+
+# Optionally change how much disk the cached TBA responses may use
+TBA_CACHE_MAX_MB = os.getenv("TBA_CACHE_MAX_MB")
+if TBA_CACHE_MAX_MB is not None:
+    tba_options["disk_cache_options"] = {"max_bytes": int(float(TBA_CACHE_MAX_MB) * 1024 * 1024)}
+
+client = AudeamusBot(team_number, tba_options=tba_options, prefetch=prefetch, webhook_options=webhook_options,
+                     metrics_port=metrics_port, **shard_options)
 
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 if DISCORD_TOKEN is None:
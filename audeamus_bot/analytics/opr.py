@@ -0,0 +1,172 @@
+from collections.abc import Iterable
+from typing import Optional
+
+import numpy as np
+
+from audeamus_bot.types.lru_cache import LRUCache
+from audeamus_bot.types.match_table import Matches
+from audeamus_bot.types.tba_types import EventOPRs, MatchSimple
+
+# A played qualification match's alliances and scores: red teams, blue teams, red score, blue score
+MatchRow = tuple[tuple[str, ...], tuple[str, ...], int, int]
+
+
+def match_row(match: MatchSimple) -> Optional[MatchRow]:
+    """Gets the alliances and scores of a played qualification match, or None for any other match."""
+    alliances = match["alliances"]
+    if match["comp_level"] != "qm" or alliances is None:
+        return None
+
+    red, blue = alliances["red"], alliances["blue"]
+    # Unplayed matches have no score, or -1
+    if red["score"] is None or blue["score"] is None or red["score"] < 0 or blue["score"] < 0:
+        return None
+    return tuple(red["team_keys"]), tuple(blue["team_keys"]), red["score"], blue["score"]
+
+
+class EventStats:
+    """The OPR, DPR and CCWM of an event's teams, computed from its qualification match scores.
+
+    Each alliance in a played match is one equation: the sum of its teams' OPRs is its score, and the sum
+    of their DPRs is its opponent's score. The ratings are the least-squares solution of these equations
+    for every team at once, with a tiny ridge term so they are defined before every team has played.
+    CCWM, the contribution to winning margin, is OPR minus DPR.
+
+    Newly played matches are added with recursive least squares: the inverse of the normal matrix is
+    kept and updated with the Sherman-Morrison formula, so each alliance costs O(teams²) instead of a
+    refit. Changed or removed scores, or a batch of many new matches, refit from scratch with NumPy.
+
+    Args:
+        regularization: the ridge term, small enough to leave fully determined ratings unchanged
+    """
+
+    def __init__(self, regularization: float = 1e-6):
+        self.regularization = regularization
+
+        self.teams: list[str] = []
+        self.team_indices: dict[str, int] = {}
+
+        # The inverse of (AᵀA + regularization × I) for the alliance-team incidence matrix A
+        self.inverse = np.zeros((0, 0))
+        # OPRs and DPRs of the teams, as two columns
+        self.ratings = np.zeros((0, 2))
+
+        # The rows each match has contributed, by match key
+        self.rows: dict[str, MatchRow] = {}
+
+        # The response the ratings were last updated from
+        self.source: Optional[Matches] = None
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _add_teams(self, team_keys: Iterable[str]):
+        new_teams = [team_key for team_key in dict.fromkeys(team_keys) if team_key not in self.team_indices]
+        if len(new_teams) == 0:
+            return
+
+        for team_key in new_teams:
+            self.team_indices[team_key] = len(self.teams)
+            self.teams.append(team_key)
+
+        # Teams that have not played are only held near zero by the ridge term
+        size = len(self.teams)
+        inverse = np.eye(size) / self.regularization
+        inverse[:self.inverse.shape[0], :self.inverse.shape[1]] = self.inverse
+        self.inverse = inverse
+        self.ratings = np.vstack([self.ratings, np.zeros((len(new_teams), 2))])
+
+    def _add_alliance(self, team_keys: tuple[str, ...], score: int, opponent_score: int):
+        """Adds one alliance's equation with a rank-one update."""
+        indices = [self.team_indices[team_key] for team_key in team_keys]
+        # Pa for the alliance's 0/1 row a, and aᵀPa
+        inverse_column = self.inverse[:, indices].sum(axis=1)
+        gain = inverse_column / (1 + inverse_column[indices].sum())
+
+        residual = np.array([score, opponent_score]) - self.ratings[indices].sum(axis=0)
+        self.ratings += np.outer(gain, residual)
+        self.inverse -= np.outer(gain, inverse_column)
+
+    def refit(self):
+        """Solves for every rating from scratch with the rows of every match."""
+        self._add_teams(team_key for red, blue, _, _ in self.rows.values() for team_key in red + blue)
+        size = len(self.teams)
+        incidence = np.zeros((2 * len(self.rows), size))
+        scores = np.zeros((2 * len(self.rows), 2))
+        for i, (red, blue, red_score, blue_score) in enumerate(self.rows.values()):
+            incidence[2 * i, [self.team_indices[team_key] for team_key in red]] = 1
+            incidence[2 * i + 1, [self.team_indices[team_key] for team_key in blue]] = 1
+            scores[2 * i] = red_score, blue_score
+            scores[2 * i + 1] = blue_score, red_score
+
+        self.inverse = np.linalg.inv(incidence.T @ incidence + self.regularization * np.eye(size))
+        self.ratings = self.inverse @ (incidence.T @ scores)
+
+    def update(self, matches: Matches) -> int:
+        """Brings the ratings up to date with a response for the event's matches.
+
+        Returns:
+            The number of matches added, changed or removed
+        """
+        if matches is self.source:
+            return 0
+        self.source = matches
+
+        rows = {}
+        for match in matches:
+            row = match_row(match)
+            if row is not None:
+                rows[match["key"]] = row
+
+        added = [key for key in rows if key not in self.rows]
+        changed = sum(1 for key, row in self.rows.items() if rows.get(key) != row)
+        self.rows = rows
+
+        # Corrections are rare, and a batch of new matches is cheaper to solve at once
+        if changed > 0 or 2 * len(added) > max(len(self.teams), 1):
+            self.refit()
+        else:
+            for key in added:
+                red, blue, red_score, blue_score = rows[key]
+                self._add_teams(red + blue)
+                self._add_alliance(red, red_score, blue_score)
+                self._add_alliance(blue, blue_score, red_score)
+        return len(added) + changed
+
+    def score_variance(self) -> float:
+        """Gets the variance of the played alliances' scores around the sums of their teams' OPRs."""
+        played_teams = {team_key for red, blue, _, _ in self.rows.values() for team_key in red + blue}
+        residuals = np.array([score - sum(self.ratings[self.team_indices[team_key], 0] for team_key in team_keys)
+                              for red, blue, red_score, blue_score in self.rows.values()
+                              for team_keys, score in ((red, red_score), (blue, blue_score))])
+        degrees_of_freedom = max(len(residuals) - len(played_teams), 1)
+        return float(residuals @ residuals) / degrees_of_freedom if len(residuals) > 0 else 0.0
+
+    def oprs(self) -> EventOPRs:
+        """Gets the ratings in the same form as TBA's ``/event/{event_key}/oprs``."""
+        oprs, dprs = self.ratings[:, 0], self.ratings[:, 1]
+        ccwms = oprs - dprs
+        return {"oprs": dict(zip(self.teams, oprs.tolist())),
+                "dprs": dict(zip(self.teams, dprs.tolist())),
+                "ccwms": dict(zip(self.teams, ccwms.tolist()))}
+
+
+class EventStatsCache:
+    """The ratings of the events most recently looked up, by event key.
+
+    Args:
+        max_entries: the maximum number of events to keep
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self._stats: LRUCache[str, EventStats] = LRUCache(max_entries)
+
+    def get(self, event_key: str, matches: Matches) -> EventStats:
+        """Gets the event's ratings, updated with the latest response for its matches."""
+        stats = self._stats.get(event_key)
+        if stats is None:
+            stats = EventStats()
+            self._stats.put(event_key, stats)
+
+        stats.update(matches)
+        return stats
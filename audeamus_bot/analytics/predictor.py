@@ -0,0 +1,93 @@
+import numpy as np
+
+from audeamus_bot.analytics.opr import EventStats, EventStatsCache, match_row
+from audeamus_bot.types.lru_cache import LRUCache
+from audeamus_bot.types.match_table import Matches
+from audeamus_bot.types.tba_types import MatchPredictions
+
+# Scales a normal margin so the logistic function approximates its CDF to within 0.01
+LOGISTIC_SCALE = 1.702
+
+
+def _team_indices(stats: EventStats, alliances: list[list[str]]) -> np.ndarray:
+    """Gets the rating index of each alliance's teams, one row per alliance.
+
+    Teams without a rating get the second to last index, and rows are padded with the last.
+    """
+    unrated = len(stats.teams)
+    width = max((len(team_keys) for team_keys in alliances), default=0)
+    indices = np.full((len(alliances), width), unrated + 1)
+    for i, team_keys in enumerate(alliances):
+        indices[i, :len(team_keys)] = [stats.team_indices.get(team_key, unrated) for team_key in team_keys]
+    return indices
+
+
+def predict_matches(stats: EventStats, matches: Matches) -> MatchPredictions:
+    """Predicts the scores and winner of every unplayed match of an event from its teams' OPRs.
+
+    Each alliance is predicted to score the sum of its teams' OPRs. The spread of the played matches'
+    scores around their OPR sums gives the variance of each prediction, and the chance the predicted
+    winner wins assumes the margin is normally distributed. Teams that have not played are given the
+    event's average OPR. Every match is predicted at once with NumPy.
+
+    Returns:
+        The predictions in the same form as TBA's, which has none for events without played matches
+    """
+    predictions: MatchPredictions = {"qual": {}, "playoff": {}}
+    # Playoff matches are listed before their alliances are known
+    unplayed = [match for match in matches if match["alliances"] is not None and match_row(match) is None
+                and all(len(alliance["team_keys"]) > 0 for alliance in match["alliances"].values())]
+    if len(stats) == 0 or len(unplayed) == 0:
+        return predictions
+
+    # Teams that have not played get the average, and padding counts for nothing
+    played_teams = {team_key for red, blue, _, _ in stats.rows.values() for team_key in red + blue}
+    played = np.array([team_key in played_teams for team_key in stats.teams])
+    average = stats.ratings[played, 0].mean()
+    oprs = np.append(np.where(played, stats.ratings[:, 0], average), [average, 0])
+
+    # The variance of an alliance's score around the sum of its OPRs, from the played matches
+    score_var = stats.score_variance()
+
+    red_teams = _team_indices(stats, [match["alliances"]["red"]["team_keys"] for match in unplayed])
+    blue_teams = _team_indices(stats, [match["alliances"]["blue"]["team_keys"] for match in unplayed])
+    red_scores, blue_scores = oprs[red_teams].sum(axis=1), oprs[blue_teams].sum(axis=1)
+    margins = red_scores - blue_scores
+    red_probs = 1 / (1 + np.exp(-LOGISTIC_SCALE * margins / max(np.sqrt(2 * score_var), 1e-9)))
+
+    for match, red_score, blue_score, red_prob in zip(unplayed, red_scores.tolist(), blue_scores.tolist(),
+                                                      red_probs.tolist()):
+        predictions["qual" if match["comp_level"] == "qm" else "playoff"][match["key"]] = {
+            "red": {"score": red_score, "score_var": score_var},
+            "blue": {"score": blue_score, "score_var": score_var},
+            "prob": red_prob if red_prob >= 0.5 else 1 - red_prob,
+            "winning_alliance": "red" if red_prob >= 0.5 else "blue",
+        }
+    return predictions
+
+
+class MatchPredictor:
+    """Predictions of the unplayed matches of the events most recently looked up, by event key.
+
+    Predictions are kept until the response for the event's matches changes.
+
+    Args:
+        stats: the cache of the events' ratings the predictions are made from
+        max_entries: the maximum number of events to keep predictions for
+    """
+
+    def __init__(self, stats: EventStatsCache, max_entries: int = 256):
+        self.stats = stats
+
+        # The response each event's predictions were made from, and the predictions
+        self._predictions: LRUCache[str, tuple[Matches, MatchPredictions]] = LRUCache(max_entries)
+
+    def get(self, event_key: str, matches: Matches) -> MatchPredictions:
+        """Gets the predictions for the event, made from the latest response for its matches."""
+        cached = self._predictions.get(event_key)
+        if cached is not None and cached[0] is matches:
+            return cached[1]
+
+        predictions = predict_matches(self.stats.get(event_key, matches), matches)
+        self._predictions.put(event_key, (matches, predictions))
+        return predictions
@@ -0,0 +1,231 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Optional
+
+import numpy as np
+
+from audeamus_bot.analytics.opr import EventStats, match_row
+from audeamus_bot.types.lru_cache import LRUCache
+from audeamus_bot.types.match_table import Matches
+from audeamus_bot.types.tba_types import EventRanking, MatchPredictions
+
+# Ranking points for a qualification win, by the first season they applied; ties are worth half
+WIN_POINTS = {2016: 2, 2025: 3}
+
+
+def win_points(year: int) -> float:
+    return WIN_POINTS[max((season for season in WIN_POINTS if season <= year), default=min(WIN_POINTS))]
+
+
+@dataclass(frozen=True)
+class RankingSimulation:
+    """How often each team finished at each rank over many simulated finishes of qualifications.
+
+    Args:
+        teams: the team keys
+        rank_counts: the number of runs each team finished at each rank, one row per team, rank 1 first
+        runs: the number of simulated runs
+    """
+    teams: list[str]
+    rank_counts: np.ndarray
+    runs: int
+
+    def expected_ranks(self) -> np.ndarray:
+        return self.rank_counts @ np.arange(1, len(self.teams) + 1) / self.runs
+
+    def top_probabilities(self, places: int = 8) -> np.ndarray:
+        """Gets each team's chance of finishing in the top places, e.g. as an alliance captain."""
+        return self.rank_counts[:, :places].sum(axis=1) / self.runs
+
+    def rank_range(self, team: int, low: float = 0.1, high: float = 0.9) -> tuple[int, int]:
+        """Gets the ranks between the quantiles of a team's finishes, by its index."""
+        cumulative = np.cumsum(self.rank_counts[team]) / self.runs
+        return int(np.searchsorted(cumulative, low)) + 1, int(np.searchsorted(cumulative, high)) + 1
+
+
+def simulate_rankings(points: np.ndarray, bonus_rates: np.ndarray, red: np.ndarray, blue: np.ndarray,
+                      margins: np.ndarray, margin_sds: np.ndarray, win_points: float, runs: int,
+                      seed: int = 0) -> np.ndarray:
+    """Plays out the remaining qualification matches many times and counts where each team finishes.
+
+    Every run is sampled at once: each match's margin is drawn around its predicted margin, the winner
+    takes the win points, and each team earns bonus ranking points at its rate so far.
+
+    Args:
+        points: each team's ranking points so far
+        bonus_rates: each team's average bonus ranking points per match so far
+        red: whether each team is on the red alliance of each remaining match, one row per match
+        blue: whether each team is on the blue alliance of each remaining match, one row per match
+        margins: the predicted red minus blue score of each remaining match
+        margin_sds: the standard deviation of each remaining match's margin
+        win_points: the ranking points for a win
+        runs: the number of runs
+        seed: the seed of the random generator, so the same state gives the same counts
+
+    Returns:
+        The number of runs each team finished at each rank, one row per team
+    """
+    rng = np.random.default_rng(seed)
+    num_teams = len(points)
+
+    sampled_margins = margins + rng.standard_normal((runs, len(margins))) * margin_sds
+    red_wins = (sampled_margins > 0).astype(float)
+    totals = points + win_points * (red_wins @ red + (1 - red_wins) @ blue)
+
+    # Bonus ranking points are usually worth up to two per match
+    remaining = red.sum(axis=0) + blue.sum(axis=0)
+    totals += rng.binomial(2 * remaining.astype(int), np.clip(bonus_rates / 2, 0, 1), size=(runs, num_teams))
+
+    # Ties are broken at random, standing in for the season's tiebreakers
+    totals += rng.random((runs, num_teams)) * 1e-3
+    ranks = np.empty((runs, num_teams), dtype=int)
+    ranks[np.arange(runs)[:, None], np.argsort(-totals, axis=1)] = np.arange(num_teams)
+    return np.bincount((np.arange(num_teams) * num_teams + ranks).ravel(),
+                       minlength=num_teams * num_teams).reshape(num_teams, num_teams)
+
+
+def _score_variance(played: dict) -> float:
+    """Gets the variance of the played alliances' scores around their OPR sums, from the played rows by key."""
+    stats = EventStats()
+    stats.rows = played
+    if len(played) > 0:
+        stats.refit()
+    return stats.score_variance()
+
+
+class RankingSimulator:
+    """Simulates events' final qualification rankings in a process pool, off the event loop.
+
+    Results are cached by event and a fingerprint of its played scores, remaining schedule and rankings,
+    so a simulation only reruns once a match is played or the schedule changes. Simulations of the same
+    state share one run.
+
+    Args:
+        runs: the number of simulated runs per simulation
+        max_workers: the number of worker processes, or None for one per CPU
+        max_entries: the maximum number of events to keep results for
+    """
+
+    def __init__(self, runs: int = 10000, max_workers: Optional[int] = None, max_entries: int = 64):
+        self.runs = runs
+        self.max_workers = max_workers
+
+        # Started on first use; spawned rather than forked, since the bot runs other threads
+        self.executor: Optional[ProcessPoolExecutor] = None
+
+        self._results: LRUCache[str, tuple[Any, RankingSimulation]] = LRUCache(max_entries)
+        self.in_flight: dict[tuple[str, Any], asyncio.Future] = {}
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def simulate(self, event_key: str, matches: Matches, predictions: MatchPredictions,
+                       rankings: Optional[EventRanking]) -> Optional[RankingSimulation]:
+        """Simulates the rest of the event's qualification matches.
+
+        Args:
+            event_key: the event
+            matches: the event's matches
+            predictions: the predicted scores of its unplayed matches
+            rankings: its current rankings, which give ranking points including bonuses, if published
+
+        Returns:
+            The simulated finishes, or None if the event has no qualification schedule
+        """
+        year = int(event_key[:4])
+        played = {}
+        remaining = []
+        for match in matches:
+            row = match_row(match)
+            if row is not None:
+                played[match["key"]] = row
+            elif match["comp_level"] == "qm" and match["alliances"] is not None:
+                alliances = match["alliances"]
+                remaining.append((match["key"], tuple(alliances["red"]["team_keys"]),
+                                  tuple(alliances["blue"]["team_keys"])))
+        if len(played) + len(remaining) == 0:
+            return None
+
+        # Rankings include bonus ranking points, which the match list does not
+        standings = {}
+        if rankings is not None and len(rankings["rankings"]) > 0:
+            for team in rankings["rankings"]:
+                if team["sort_orders"]:
+                    standings[team["team_key"]] = (team["sort_orders"][0] * team["matches_played"],
+                                                   team["record"]["wins"], team["record"]["ties"],
+                                                   team["matches_played"])
+        fingerprint = (tuple(played.items()), tuple(remaining), tuple(sorted(standings.items())))
+
+        cached = self._results.get(event_key)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+
+        in_flight = self.in_flight.get((event_key, fingerprint))
+        if in_flight is None:
+            in_flight = asyncio.ensure_future(self._run(event_key, fingerprint, played, remaining, predictions,
+                                                        standings, win_points(year)))
+            self.in_flight[event_key, fingerprint] = in_flight
+            in_flight.add_done_callback(lambda _: self.in_flight.pop((event_key, fingerprint), None))
+        return await asyncio.shield(in_flight)
+
+    async def _run(self, event_key: str, fingerprint: Any, played: dict, remaining: list,
+                   predictions: MatchPredictions, standings: dict, points_per_win: float) -> RankingSimulation:
+        teams = sorted({team_key for red, blue, _, _ in played.values() for team_key in red + blue}
+                       | {team_key for _, red, blue in remaining for team_key in red + blue} | standings.keys())
+        indices = {team_key: i for i, team_key in enumerate(teams)}
+
+        points = np.zeros(len(teams))
+        bonus_rates = np.zeros(len(teams))
+        if standings:
+            for team_key, (total, wins, ties, matches_played) in standings.items():
+                points[indices[team_key]] = total
+                if matches_played > 0:
+                    bonus = total - points_per_win * (wins + ties / 2)
+                    bonus_rates[indices[team_key]] = max(bonus, 0) / matches_played
+        else:
+            # Without rankings, only wins and ties count
+            for red, blue, red_score, blue_score in played.values():
+                if red_score == blue_score:
+                    red_points = points_per_win / 2
+                else:
+                    red_points = points_per_win if red_score > blue_score else 0
+                for team_key in red:
+                    points[indices[team_key]] += red_points
+                for team_key in blue:
+                    points[indices[team_key]] += points_per_win - red_points
+
+        red = np.zeros((len(remaining), len(teams)))
+        blue = np.zeros((len(remaining), len(teams)))
+        margins = np.zeros(len(remaining))
+        margin_sds = np.zeros(len(remaining))
+        fallback_var: Optional[float] = None
+        for i, (key, red_teams, blue_teams) in enumerate(remaining):
+            red[i, [indices[team_key] for team_key in red_teams]] = 1
+            blue[i, [indices[team_key] for team_key in blue_teams]] = 1
+            # Before any match is played there is nothing to predict from, so every match is a coin flip
+            prediction = predictions["qual"].get(key)
+            if prediction is not None:
+                margins[i] = prediction["red"]["score"] - prediction["blue"]["score"]
+                red_var, blue_var = prediction["red"].get("score_var"), prediction["blue"].get("score_var")
+                if (red_var is None or blue_var is None) and fallback_var is None:
+                    # TBA's predictions have no variance, so use the spread of the played scores around their OPRs
+                    fallback_var = _score_variance(played)
+                margin_sds[i] = np.sqrt((fallback_var if red_var is None else red_var)
+                                        + (fallback_var if blue_var is None else blue_var))
+            # A margin with no spread would be decided the same way in every run
+            if margin_sds[i] == 0:
+                margin_sds[i] = 1
+
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        rank_counts = await asyncio.get_running_loop().run_in_executor(
+            self.executor, simulate_rankings, points, bonus_rates, red, blue, margins, margin_sds, points_per_win,
+            self.runs)
+
+        simulation = RankingSimulation(teams, rank_counts, self.runs)
+        self._results.put(event_key, (fingerprint, simulation))
+        return simulation
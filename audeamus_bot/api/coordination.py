@@ -0,0 +1,162 @@
+import asyncio
+import os
+import socket
+import time
+from typing import Optional
+
+import aiosqlite
+
+# Seconds a connection waits for another process to finish writing before giving up
+BUSY_TIMEOUT = 30
+
+
+class Coordinator:
+    """Coordinates TBA requests between bot processes that share a cache database.
+
+    Processes, e.g. ones running different shards, take a lease on a URL before fetching it, so only
+    one of them revalidates an endpoint while the others wait for the response to land in the shared
+    cache. Every request to TBA also takes a token from one bucket kept in the database, so adding
+    processes does not raise the upstream request rate. Invalidations, e.g. from webhooks received by
+    one process, are recorded so the others can drop their in-memory copies. The database is switched to
+    WAL mode so readers are not blocked while another process writes.
+
+    Args:
+        filename: the SQLite database shared by the processes
+        owner: identifies this process in leases; defaults to the host name and process ID
+        lease_seconds: how long a lease lasts if its process dies before releasing it
+        requests_per_second: the rate of the shared request budget, or None for no limit
+        burst: the number of requests that can be sent at once after a quiet period
+        poll_interval: seconds between checks while waiting for another process's response
+        invalidation_interval: seconds between checks for other processes' invalidations
+        invalidation_ttl: seconds invalidations are kept for processes to read them
+    """
+
+    def __init__(self, filename: str, owner: Optional[str] = None, lease_seconds: float = 30,
+                 requests_per_second: Optional[float] = 10, burst: int = 20, poll_interval: float = 0.1,
+                 invalidation_interval: float = 1, invalidation_ttl: float = 10 * 60):
+        self.filename = filename
+        self.owner = owner if owner is not None else f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.poll_interval = poll_interval
+        self.invalidation_interval = invalidation_interval
+        self.invalidation_ttl = invalidation_ttl
+
+        # Connected on first use; transactions are managed by hand, so only one runs at a time
+        self.connection: Optional[aiosqlite.Connection] = None
+        self.lock = asyncio.Lock()
+
+    async def _connect(self) -> aiosqlite.Connection:
+        if self.connection is None:
+            connection = await aiosqlite.connect(self.filename, timeout=BUSY_TIMEOUT, isolation_level=None)
+            await connection.execute("PRAGMA journal_mode=WAL")
+            await connection.execute("CREATE TABLE IF NOT EXISTS leases "
+                                     "(key TEXT PRIMARY KEY, owner TEXT, expires REAL)")
+            await connection.execute("CREATE TABLE IF NOT EXISTS budget "
+                                     "(name TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+            await connection.execute("CREATE TABLE IF NOT EXISTS invalidations "
+                                     "(id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT, owner TEXT, created REAL)")
+            self.connection = connection
+        return self.connection
+
+    async def close(self):
+        if self.connection is not None:
+            await self.connection.close()
+            self.connection = None
+
+    async def acquire_lease(self, key: str) -> bool:
+        """Takes the lease on the key unless another process holds an unexpired one.
+
+        Returns:
+            Whether this process now holds the lease
+        """
+        now = time.time()
+        async with self.lock:
+            connection = await self._connect()
+            cursor = await connection.execute(
+                "INSERT INTO leases (key, owner, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, expires = excluded.expires "
+                "WHERE leases.expires < ? OR leases.owner = excluded.owner",
+                (key, self.owner, now + self.lease_seconds, now))
+            return cursor.rowcount > 0
+
+    async def release_lease(self, key: str):
+        async with self.lock:
+            connection = await self._connect()
+            await connection.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, self.owner))
+
+    async def publish_invalidation(self, key: str):
+        """Records that this process invalidated the key, for the other processes to follow."""
+        now = time.time()
+        async with self.lock:
+            connection = await self._connect()
+            await connection.execute("INSERT INTO invalidations (key, owner, created) VALUES (?, ?, ?)",
+                                     (key, self.owner, now))
+            await connection.execute("DELETE FROM invalidations WHERE created < ?", (now - self.invalidation_ttl,))
+
+    async def invalidations_since(self, last_id: Optional[int]) -> tuple[list[str], int]:
+        """Gets the keys other processes invalidated after the given invalidation.
+
+        Args:
+            last_id: the ID of the last invalidation already seen, or None to only get the latest ID
+
+        Returns:
+            The invalidated keys, and the ID of the latest invalidation
+        """
+        async with self.lock:
+            connection = await self._connect()
+            async with connection.execute("SELECT COALESCE(MAX(id), 0) FROM invalidations") as cursor:
+                latest = (await cursor.fetchone())[0]  # type: ignore
+            if last_id is None or latest <= last_id:
+                return [], latest
+            async with connection.execute("SELECT key FROM invalidations WHERE id > ? AND id <= ? AND owner != ?",
+                                          (last_id, latest, self.owner)) as cursor:
+                return [row[0] for row in await cursor.fetchall()], latest
+
+    async def acquire_request(self) -> float:
+        """Waits until the shared budget allows another request to TBA.
+
+        Returns:
+            The number of seconds spent waiting
+        """
+        if self.requests_per_second is None:
+            return 0
+
+        waited = 0.0
+        while True:
+            wait = await self._take_token()
+            if wait == 0:
+                return waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+    async def _take_token(self) -> float:
+        """Takes a token from the bucket if there is one, otherwise gets the seconds until there is."""
+        async with self.lock:
+            connection = await self._connect()
+            # Lock the database for writing right away so no other process reads the bucket in between
+            await connection.execute("BEGIN IMMEDIATE")
+            try:
+                async with connection.execute("SELECT tokens, updated FROM budget WHERE name = 'tba'") as cursor:
+                    row = await cursor.fetchone()
+
+                now = time.time()
+                if row is None:
+                    tokens = float(self.burst)
+                else:
+                    tokens = min(float(self.burst), row[0] + max(0.0, now - row[1]) * self.requests_per_second)
+
+                if tokens >= 1:
+                    tokens -= 1
+                    wait = 0.0
+                else:
+                    wait = (1 - tokens) / self.requests_per_second  # type: ignore
+
+                await connection.execute("INSERT OR REPLACE INTO budget (name, tokens, updated) VALUES ('tba', ?, ?)",
+                                         (tokens, now))
+                await connection.execute("COMMIT")
+            except BaseException:
+                await connection.execute("ROLLBACK")
+                raise
+            return wait
@@ -0,0 +1,270 @@
+import asyncio
+import calendar
+import pickle
+import sqlite3
+import time
+import traceback
+import zlib
+from dataclasses import dataclass
+from typing import Optional
+
+import aiosqlite
+
+from audeamus_bot.api.coordination import BUSY_TIMEOUT
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Responses read within this many seconds of their last read are not written back just to update the LRU order
+TOUCH_INTERVAL = 60
+
+
+def compress(body: bytes) -> tuple[bytes, str]:
+    """Compresses a response body with zstd if it is installed, otherwise zlib.
+
+    Returns:
+        The compressed body and the name of the compression
+    """
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(body), "zstd"
+    return zlib.compress(body, 6), "zlib"
+
+
+def decompress(data: bytes, compression: str) -> bytes:
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstandard is needed to read responses cached with zstd")
+        return zstandard.ZstdDecompressor().decompress(data)
+    elif compression == "zlib":
+        return zlib.decompress(data)
+    return data
+
+
+@dataclass
+class StoredResponse:
+    """A cached TBA response; the body is only decompressed when it is needed."""
+    data: bytes
+    compression: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    expires: float
+
+    @property
+    def body(self) -> bytes:
+        return decompress(self.data, self.compression)
+
+    @property
+    def is_expired(self) -> bool:
+        return self.expires <= time.time()
+
+
+class DiskCache:
+    """A size-bounded SQLite store of compressed TBA response bodies with their ETags and expiry times.
+
+    When the store is larger than ``max_bytes``, the least recently read responses are evicted, and
+    responses not read for ``max_idle`` seconds are dropped. The database is compacted with VACUUM every
+    ``compact_interval`` seconds while ``start`` has been called. Responses cached by the old
+    aiohttp-client-cache backend in the same file are migrated the first time it is opened.
+
+    Args:
+        filename: the SQLite database file
+        max_bytes: the maximum total size of the compressed bodies
+        max_idle: seconds after its last read that a response is dropped
+        compact_interval: seconds between evictions and compactions of the database
+    """
+
+    def __init__(self, filename: str, max_bytes: int = 64 * 1024 * 1024, max_idle: float = 30 * 24 * 60 * 60,
+                 compact_interval: float = 6 * 60 * 60):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.max_idle = max_idle
+        self.compact_interval = compact_interval
+
+        # Connected on first use, since the TBAClient is created outside of a coroutine
+        self.connection: Optional[aiosqlite.Connection] = None
+        self.lock = asyncio.Lock()
+
+        # When each response was last marked as read, to limit writes for the LRU order
+        self.touched: dict[str, float] = {}
+
+        self.task: Optional[asyncio.Task] = None
+
+    async def _connect(self) -> aiosqlite.Connection:
+        async with self.lock:
+            if self.connection is None:
+                connection = await aiosqlite.connect(self.filename, timeout=BUSY_TIMEOUT)
+                await connection.execute("PRAGMA journal_mode=WAL")
+                await connection.execute("CREATE TABLE IF NOT EXISTS tba_responses (url TEXT PRIMARY KEY, "
+                                         "data BLOB NOT NULL, compression TEXT NOT NULL, etag TEXT, "
+                                         "last_modified TEXT, expires REAL NOT NULL, accessed REAL NOT NULL, "
+                                         "size INTEGER NOT NULL)")
+                await connection.execute("CREATE INDEX IF NOT EXISTS tba_responses_accessed "
+                                         "ON tba_responses (accessed)")
+                await connection.commit()
+                await _migrate(connection)
+                self.connection = connection
+        return self.connection
+
+    def start(self):
+        """Starts evicting and compacting in the background."""
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def close(self):
+        await self.stop()
+        if self.connection is not None:
+            await self.connection.close()
+            self.connection = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.compact_interval)
+            try:
+                await self.evict()
+                await self.compact()
+            except Exception:
+                traceback.print_exc()
+
+    async def get(self, url: str) -> Optional[StoredResponse]:
+        connection = await self._connect()
+        async with connection.execute("SELECT data, compression, etag, last_modified, expires FROM tba_responses "
+                                      "WHERE url = ?", (url,)) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+
+        now = time.time()
+        if now - self.touched.get(url, 0) > TOUCH_INTERVAL:
+            self.touched[url] = now
+            await connection.execute("UPDATE tba_responses SET accessed = ? WHERE url = ?", (now, url))
+            await connection.commit()
+        return StoredResponse(*row)
+
+    async def put(self, url: str, body: bytes, etag: Optional[str], last_modified: Optional[str], max_age: float):
+        """Stores a response body, replacing any earlier response for the URL."""
+        data, compression = compress(body)
+        now = time.time()
+        self.touched[url] = now
+
+        connection = await self._connect()
+        await connection.execute("INSERT OR REPLACE INTO tba_responses "
+                                 "(url, data, compression, etag, last_modified, expires, accessed, size) "
+                                 "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                 (url, data, compression, etag, last_modified, now + max_age, now, len(data)))
+        await connection.commit()
+
+    async def revalidated(self, url: str, max_age: float):
+        """Marks the response for the URL as fresh again after TBA said it has not changed."""
+        now = time.time()
+        self.touched[url] = now
+
+        connection = await self._connect()
+        await connection.execute("UPDATE tba_responses SET expires = ?, accessed = ? WHERE url = ?",
+                                 (now + max_age, now, url))
+        await connection.commit()
+
+    async def expire(self, url: str):
+        """Marks the response for the URL as expired, keeping it and its ETag for revalidation."""
+        connection = await self._connect()
+        # Staleness is counted from now, so the response can still be served if TBA fails
+        await connection.execute("UPDATE tba_responses SET expires = MIN(expires, ?) WHERE url = ?",
+                                 (time.time(), url))
+        await connection.commit()
+
+    async def delete(self, url: str):
+        connection = await self._connect()
+        await connection.execute("DELETE FROM tba_responses WHERE url = ?", (url,))
+        await connection.commit()
+
+    async def size(self) -> int:
+        """Gets the total size of the compressed bodies."""
+        connection = await self._connect()
+        async with connection.execute("SELECT total(size) FROM tba_responses") as cursor:
+            row = await cursor.fetchone()
+        return int(row[0])  # type: ignore
+
+    async def evict(self) -> int:
+        """Drops idle responses, then the least recently read ones until the store fits in ``max_bytes``.
+
+        Returns:
+            The number of responses dropped
+        """
+        connection = await self._connect()
+        cursor = await connection.execute("DELETE FROM tba_responses WHERE accessed < ?",
+                                          (time.time() - self.max_idle,))
+        evicted = cursor.rowcount
+
+        # Keep the most recently read responses that fit, and drop the rest
+        cursor = await connection.execute(
+            "DELETE FROM tba_responses WHERE url IN (SELECT url FROM (SELECT url, "
+            "sum(size) OVER (ORDER BY accessed DESC, url) AS kept FROM tba_responses) WHERE kept > ?)",
+            (self.max_bytes,))
+        evicted += cursor.rowcount
+        await connection.commit()
+        return evicted
+
+    async def compact(self):
+        """Rewrites the database file without the space freed by evictions."""
+        connection = await self._connect()
+        try:
+            await connection.execute("VACUUM")
+            await connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.OperationalError:
+            # Another process is using the database; it will be compacted next time
+            pass
+
+
+async def _migrate(connection: aiosqlite.Connection):
+    """Moves responses cached by aiohttp-client-cache into the new table and drops its tables."""
+    async with connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                                  "AND name IN ('responses', 'redirects', 'etags')") as cursor:
+        old_tables = {name for name, in await cursor.fetchall()}
+    if len(old_tables) == 0:
+        return
+
+    etags = {}
+    if "etags" in old_tables:
+        async with connection.execute("SELECT key, value FROM etags") as cursor:
+            etags = dict(await cursor.fetchall())
+
+    migrated = 0
+    if "responses" in old_tables:
+        now = time.time()
+        async with connection.execute("SELECT value FROM responses") as cursor:
+            rows = await cursor.fetchall()
+        for value, in rows:
+            # The pickles need aiohttp-client-cache to load; without it the responses are fetched again
+            try:
+                response = pickle.loads(value)
+                url = str(response.url)
+                body = response._body
+                expires = calendar.timegm(response.expires.timetuple()) if response.expires is not None else 0
+            except Exception:
+                continue
+            if response.status != 200 or body is None:
+                continue
+
+            data, compression = compress(body)
+            await connection.execute("INSERT OR IGNORE INTO tba_responses "
+                                     "(url, data, compression, etag, last_modified, expires, accessed, size) "
+                                     "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                     (url, data, compression, etags.get(url) or response.headers.get("ETag"),
+                                      response.headers.get("Last-Modified"), expires, now, len(data)))
+            migrated += 1
+
+    for table in old_tables:
+        await connection.execute(f"DROP TABLE {table}")
+    await connection.commit()
+    await connection.execute("VACUUM")
+    print(f"Migrated {migrated} cached TBA responses to the new cache format")
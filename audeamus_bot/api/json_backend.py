@@ -0,0 +1,61 @@
+"""Decodes JSON with the fastest installed library: orjson, then msgspec, then the standard library.
+
+Install the ``fast`` extra (``pip install .[fast]``) for orjson and msgspec. With msgspec installed,
+responses can also be validated against the types in ``tba_types`` while they are decoded.
+"""
+import json
+from typing import Any, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+if orjson is not None:
+    BACKEND = "orjson"
+elif msgspec is not None:
+    BACKEND = "msgspec"
+else:
+    BACKEND = "json"
+
+# Decoders by type, created on first use since building one inspects the type
+_typed_decoders: dict[Any, Any] = {}
+
+
+def loads(body: bytes | str) -> Any:
+    """Decodes JSON without validating it."""
+    if orjson is not None:
+        return orjson.loads(body)
+    if msgspec is not None:
+        try:
+            return msgspec.json.decode(body)
+        except msgspec.DecodeError as error:
+            raise ValueError(str(error)) from error
+    return json.loads(body)
+
+
+def decode(body: bytes, response_type: Optional[Any] = None) -> Any:
+    """Decodes JSON, checking it matches the type if one is given and msgspec is installed.
+
+    Args:
+        body: the JSON
+        response_type: the type the JSON should have, e.g. ``list[MatchSimple]``
+
+    Raises:
+        ValueError: if the JSON is invalid or does not match the type
+    """
+    if response_type is None or msgspec is None:
+        return loads(body)
+
+    decoder = _typed_decoders.get(response_type)
+    if decoder is None:
+        decoder = _typed_decoders[response_type] = msgspec.json.Decoder(response_type)
+    try:
+        return decoder.decode(body)
+    except msgspec.DecodeError as error:
+        raise ValueError(f"Unexpected response from the TBA API: {error}") from error
@@ -0,0 +1,140 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional
+
+
+@dataclass
+class CacheEntry:
+    data: Any
+    size: int
+    expires: float
+    etag: Optional[str] = None
+    # Set when the data is known to be out of date, so it is only served if the TBA API fails
+    invalidated: bool = False
+
+
+@dataclass(frozen=True)
+class CachePolicy:
+    """How long expired data may still be served for an endpoint.
+
+    Args:
+        stale_while_revalidate: seconds after expiry during which the old data is returned
+            immediately while it is refreshed in the background
+        stale_if_error: seconds after expiry during which the old data is returned if the TBA API fails
+    """
+    stale_while_revalidate: float = 0
+    stale_if_error: float = 0
+
+
+class ResponseCache:
+    """A bounded in-memory LRU cache of decoded JSON responses.
+
+    Entries expire according to the ``max-age`` the TBA API sends in its
+    ``Cache-Control`` header, but are kept after that so they can be served
+    stale or revalidated. The least recently used entries are evicted once
+    either the entry count or the total body size exceeds its limit.
+
+    Args:
+        max_entries: the maximum number of responses to keep
+        max_bytes: the maximum total size of the raw response bodies to keep
+    """
+
+    def __init__(self, max_entries: int = 512, max_bytes: int = 32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Gets the entry for the key if it has not expired, counting a hit or a miss."""
+        entry = self._entries.get(key)
+        if entry is None or entry.expires <= time.monotonic():
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def get_stale(self, key: str, max_stale: float, invalidated: bool = True) -> Optional[CacheEntry]:
+        """Gets the entry for the key if it expired no more than ``max_stale`` seconds ago.
+
+        Args:
+            key: the cache key
+            max_stale: the most seconds since the entry expired
+            invalidated: whether to return an entry that was expired with ``expire``
+        """
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry.expires > max_stale or (entry.invalidated and not invalidated):
+            return None
+
+        self._entries.move_to_end(key)
+        self.stale_hits += 1
+        return entry
+
+    def peek(self, key: str) -> Optional[CacheEntry]:
+        """Gets the entry for the key even if it has expired, without touching the counters."""
+        return self._entries.get(key)
+
+    def put(self, key: str, data: Any, size: int, max_age: float, etag: Optional[str] = None):
+        """Stores decoded data for the key, evicting old entries if over the limits.
+
+        Args:
+            key: the cache key (usually the full URL)
+            data: the decoded JSON
+            size: the size of the raw response body in bytes
+            max_age: the number of seconds the data stays fresh
+            etag: the ETag of the response, so the data can be reused when the same body is seen again
+        """
+        self.pop(key)
+        if size > self.max_bytes:
+            return
+
+        self._entries[key] = CacheEntry(data, size, time.monotonic() + max_age, etag)
+        self.total_bytes += size
+
+        while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= evicted.size
+            self.evictions += 1
+
+    def expire(self, key: str):
+        """Marks the entry for the key as expired, keeping its data for revalidation."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.expires = time.monotonic()
+            entry.invalidated = True
+
+    def pop(self, key: str) -> Optional[CacheEntry]:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+        return entry
+
+    def clear(self):
+        self._entries.clear()
+        self.total_bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        """Gets the hit/miss counters and current usage of the cache."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_hits": self.stale_hits,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+        }
@@ -1,112 +1,407 @@
+import asyncio
 import os
-from typing import Any, Optional
-
-from aiohttp_client_cache import SQLiteBackend
-from aiohttp_client_cache.session import CachedSession
+import re
+import sys
+import time
+import traceback
+from contextvars import ContextVar
+from typing import Any, Callable, Optional
+
+import aiohttp
 from dotenv import load_dotenv
 
-from audeamus_bot.types.tba_types import Event, EventPredictions, MatchSimple, EventOPRs, EventRanking, DistrictRanking
+from audeamus_bot.api import json_backend
+from audeamus_bot.api.coordination import Coordinator
+from audeamus_bot.api.disk_cache import DiskCache, StoredResponse
+from audeamus_bot.api.response_cache import CachePolicy, ResponseCache
+from audeamus_bot.metrics import Metrics
+from audeamus_bot.types.match_table import MatchTable
+from audeamus_bot.types.tba_types import (APIStatus, Event, EventPredictions, MatchSimple, EventOPRs, EventRanking,
+                                          DistrictRanking)
 
 load_dotenv()
 
 TBA_API_KEY = os.getenv("TBA_API_KEY")
 
-HEADERS = {
-    "X-TBA-AUTH-KEY": TBA_API_KEY
+# Can point at a stand-in server, see benchmarks/tba_standin.py
+BASE_URL = os.getenv("TBA_BASE_URL", "https://www.thebluealliance.com/api/v3")
+
+# Used for endpoints without their own policy: data changes often during events
+DEFAULT_POLICY = CachePolicy(stale_while_revalidate=60, stale_if_error=24 * 60 * 60)
+
+# Endpoints whose data rarely changes can be served stale for longer
+DEFAULT_POLICIES = {
+    "team_events_year": CachePolicy(stale_while_revalidate=60 * 60, stale_if_error=7 * 24 * 60 * 60),
+    "team_events_year_keys": CachePolicy(stale_while_revalidate=60 * 60, stale_if_error=7 * 24 * 60 * 60),
+    "event_teams_keys": CachePolicy(stale_while_revalidate=60 * 60, stale_if_error=7 * 24 * 60 * 60),
+    "events_year": CachePolicy(stale_while_revalidate=60 * 60, stale_if_error=7 * 24 * 60 * 60),
+    "status": CachePolicy(stale_while_revalidate=60 * 60, stale_if_error=7 * 24 * 60 * 60),
+    "team_events_statuses": CachePolicy(stale_while_revalidate=5 * 60, stale_if_error=24 * 60 * 60),
+    "district_rankings": CachePolicy(stale_while_revalidate=60 * 60, stale_if_error=7 * 24 * 60 * 60),
 }
 
-BASE_URL = "https://www.thebluealliance.com/api/v3"
-
-etags = {}
-
-session: Optional[CachedSession] = None
+# The types responses are checked against when validation is on, by endpoint method name.
+# Predictions are left out since their fields change every season.
+RESPONSE_TYPES = {
+    "event_matches_simple": list[MatchSimple],
+    "team_matches_year_simple": list[MatchSimple],
+    "team_events_year": list[Event],
+    "team_events_year_keys": list[str],
+    "events_year": list[Event],
+    "event_teams_keys": list[str],
+    "status": APIStatus,
+    "event_oprs": Optional[EventOPRs],
+    "event_rankings": Optional[EventRanking],
+    "district_rankings": list[DistrictRanking],
+}
 
+# The paths that were served stale because the TBA API failed, see track_stale_responses
+stale_responses: ContextVar[Optional[list[str]]] = ContextVar("stale_responses", default=None)
 
-async def get_json(path: str) -> Any:
-    """Gets the JSON response for the specified endpoint for the TBA API.
 
-    Handles caching; see https://www.thebluealliance.com/apidocs for more info.
-
-    Args:
-        path: the URL of the endpoint
+def track_stale_responses() -> list[str]:
+    """Starts recording the paths served stale in the current context, e.g. for one command.
 
     Returns:
-
+        The list the paths will be added to
     """
-    global session
-
-    # Create session if not already created
-    if session is None:
-        session = CachedSession(cache=SQLiteBackend(cache_name='api_cache',
-                                                    cache_control=True))
-
-    # Get full URL and headers
-    full_url = BASE_URL + path
-
-    if full_url in etags:
-        headers = {**HEADERS, "If-None-Match": etags[full_url]}
-    else:
-        headers = HEADERS
-
-    # Necessary to manually get cached response because if it expired,
-    # then it will be deleted during the request.
-    cache_key = session.cache.create_key("GET", full_url)
-    cached_response = await session.cache.responses.read(cache_key)
-
-    # Send request
-    async with session.get(full_url, headers=headers) as response:
-        if response.status == 200:
-            # This means either the response was cached or there was new data.
-            etags[full_url] = response.headers["ETag"]
-            return await response.json()
-        elif response.status == 304:
-            # This means the cache expired but the server said the data was not changed.
-            if cached_response is not None:
-                # Re-cache original cached data
-                await session.cache.responses.write(cache_key, cached_response)
-                # Return cached data
-                cached_data = await cached_response.json()  # type: ignore
-                return cached_data
-            else:
-                # this shouldn't happen but just in case...
-                etags.pop(full_url)
-        elif response.status == 404:
-            raise FileNotFoundError("404 Not Found; check your parameters?")
-        else:
-            raise ConnectionError(f"Error accessing the TBA API; status code {response.status}.")
+    paths = []
+    stale_responses.set(paths)
+    return paths
 
 
-async def event_matches_simple(event_key: str) -> list[MatchSimple]:
-    return await get_json(f"/event/{event_key}/matches/simple")
+def _max_age(response: aiohttp.ClientResponse) -> float:
+    """Gets the number of seconds the response stays fresh for."""
+    match = re.search(r"max-age=(\d+)", response.headers.get("Cache-Control", ""))
+    return int(match.group(1)) if match else 0
 
 
-async def team_events_statuses(team_key: str, year: int) -> dict:
-    return await get_json(f"/team/{team_key}/events/{year}/statuses")
+class TBAClient:
+    """A client for the TBA API with a managed connection pool and layered caching.
 
+    Must be created inside a running event loop, e.g. in ``AudeamusBot.setup_hook``.
+
+    Args:
+        api_key: the TBA read API key
+        base_url: the base URL of the TBA API
+        cache_name: the name of the SQLite database for cached responses, without the ``.sqlite`` extension
+        pool_size: the maximum number of open connections
+        per_host_limit: the maximum number of open connections to the TBA host
+        keepalive_timeout: the number of seconds an idle connection is kept open for reuse
+        dns_cache_ttl: the number of seconds DNS lookups are cached for
+        timeout: the total number of seconds a request may take
+        connect_timeout: the number of seconds acquiring a connection may take
+        response_cache: the in-memory cache of decoded responses
+        policies: cache policies by endpoint method name, overriding ``DEFAULT_POLICIES``
+        default_policy: the cache policy for endpoints without their own
+        metrics: where to record requests and cache lookups
+        coordinator_options: keyword arguments for a Coordinator, given when several processes share the cache
+        compact_matches: whether to keep lists of matches in memory as MatchTables instead of JSON dicts
+        validate: whether to check responses against RESPONSE_TYPES while decoding them; needs msgspec
+        disk_cache_options: keyword arguments for the DiskCache, e.g. its maximum size
+    """
+
+    def __init__(self, api_key: Optional[str] = TBA_API_KEY, base_url: str = BASE_URL,
+                 cache_name: str = "api_cache", pool_size: int = 100, per_host_limit: int = 20,
+                 keepalive_timeout: float = 60, dns_cache_ttl: int = 300, timeout: float = 10,
+                 connect_timeout: float = 5, response_cache: Optional[ResponseCache] = None,
+                 policies: Optional[dict[str, CachePolicy]] = None, default_policy: CachePolicy = DEFAULT_POLICY,
+                 metrics: Optional[Metrics] = None, coordinator_options: Optional[dict] = None,
+                 compact_matches: bool = False, validate: bool = False, disk_cache_options: Optional[dict] = None):
+        self.headers = {"X-TBA-AUTH-KEY": api_key}
+        self.base_url = base_url
+
+        connector = aiohttp.TCPConnector(limit=pool_size, limit_per_host=per_host_limit,
+                                         keepalive_timeout=keepalive_timeout, ttl_dns_cache=dns_cache_ttl)
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             timeout=aiohttp.ClientTimeout(total=timeout, connect=connect_timeout))
+
+        # Compressed response bodies with their ETags, kept across restarts
+        self.disk_cache = DiskCache(f"{cache_name}.sqlite", **(disk_cache_options or {}))
+        self.disk_cache.start()
+
+        # Decoded responses kept in memory so hot endpoints skip the SQLite cache entirely
+        self.response_cache = response_cache if response_cache is not None else ResponseCache()
+
+        # Fetches currently running, keyed by full URL, so identical concurrent requests share one
+        self.in_flight: dict[str, asyncio.Task] = {}
+
+        # Converts the decoded JSON of an endpoint, by endpoint method name, before it is cached in memory
+        self.decoders: dict[str, Callable[[Any], Any]] = {}
+        if compact_matches:
+            self.decoders["event_matches_simple"] = MatchTable.from_matches
+            self.decoders["team_matches_year_simple"] = MatchTable.from_matches
+
+        self.validate = validate
+
+        self.policies = {**DEFAULT_POLICIES, **(policies or {})}
+        self.default_policy = default_policy
+
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.metrics.add_collector(self._collect_cache_metrics)
+
+        # Other processes using the same cache database take turns revalidating and share one request budget
+        if coordinator_options is not None:
+            self.coordinator: Optional[Coordinator] = Coordinator(self.disk_cache.filename, **coordinator_options)
+            # Drops the in-memory copies of responses the other processes invalidate
+            self.invalidation_task: Optional[asyncio.Task] = asyncio.create_task(self._follow_invalidations())
+        else:
+            self.coordinator = None
+            self.invalidation_task = None
+
+    async def close(self):
+        if self.invalidation_task is not None:
+            self.invalidation_task.cancel()
+        await self.session.close()
+        await self.disk_cache.close()
+        if self.coordinator is not None:
+            await self.coordinator.close()
+
+    def _collect_cache_metrics(self):
+        stats = self.response_cache.stats()
+        yield "tba_memory_cache_entries", "gauge", "Responses in the in-memory cache", {}, stats["entries"]
+        yield "tba_memory_cache_bytes", "gauge", "Size of the responses in the in-memory cache", {}, stats["bytes"]
+        yield ("tba_memory_cache_evictions_total", "counter", "Responses evicted from the in-memory cache", {},
+               stats["evictions"])
+
+    async def get_json(self, path: str, endpoint: str = "other") -> Any:
+        """Gets the JSON response for the specified endpoint for the TBA API.
+
+        Handles caching; see https://www.thebluealliance.com/apidocs for more info.
+
+        Args:
+            path: the URL of the endpoint
+            endpoint: the name of the endpoint, used to pick its cache policy and label its metrics
+
+        Returns:
+            The decoded JSON response. The same object is returned for as long as the response's ETag is
+            unchanged, so callers can tell whether the data changed by comparing it with ``is``.
+        """
+        full_url = self.base_url + path
+        policy = self.policies.get(endpoint, self.default_policy)
+
+        # Serve fresh data straight from memory
+        entry = self.response_cache.get(full_url)
+        if entry is not None:
+            self.metrics.inc("tba_cache_total", {"result": "hit"})
+            return entry.data
+
+        # Serve recently expired data without waiting for the refresh, unless it is known to be out of date
+        entry = self.response_cache.get_stale(full_url, policy.stale_while_revalidate, invalidated=False)
+        if entry is not None:
+            self.metrics.inc("tba_cache_total", {"result": "stale"})
+            self._start_fetch(full_url, endpoint)
+            return entry.data
+
+        self.metrics.inc("tba_cache_total", {"result": "miss"})
+        try:
+            # Shielded so that a cancelled caller does not cancel the fetch the other callers are waiting on
+            return await asyncio.shield(self._start_fetch(full_url, endpoint))
+        except (ConnectionError, aiohttp.ClientError, asyncio.TimeoutError):
+            # Fall back to the last good copy if TBA is unavailable, from disk if it is no longer in memory
+            entry = self.response_cache.get_stale(full_url, policy.stale_if_error)
+            if entry is not None:
+                data = entry.data
+            else:
+                stored = await self.disk_cache.get(full_url)
+                if stored is None or time.time() - stored.expires > policy.stale_if_error:
+                    raise
+                # Kept in memory with the same expiry, so it is not served for longer than the policy allows
+                data = self._remember(full_url, endpoint, stored.etag, stored.expires - time.time(), stored)
+
+            self.metrics.inc("tba_cache_total", {"result": "stale_on_error"})
+            paths = stale_responses.get()
+            if paths is not None:
+                paths.append(path)
+            return data
+
+    def _start_fetch(self, full_url: str, endpoint: str) -> asyncio.Task:
+        # Join an identical request that is already running instead of sending another one
+        task = self.in_flight.get(full_url)
+        if task is None:
+            task = asyncio.create_task(self._coordinated_fetch(full_url, endpoint))
+            self.in_flight[full_url] = task
+            task.add_done_callback(lambda done: self._finish_fetch(full_url, done))
+        return task
+
+    def _finish_fetch(self, full_url: str, task: asyncio.Task):
+        self.in_flight.pop(full_url, None)
+        # Mark the exception as retrieved in case every caller was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    async def _coordinated_fetch(self, full_url: str, endpoint: str) -> Any:
+        """Fetches the URL, letting only one of the processes sharing the cache revalidate it at a time."""
+        if self.coordinator is None:
+            return await self._fetch_json(full_url, endpoint)
+
+        while not await self.coordinator.acquire_lease(full_url):
+            # Another process is revalidating the URL, so wait for its response to reach the shared cache
+            stored = await self.disk_cache.get(full_url)
+            if stored is not None and not stored.is_expired:
+                return await self._fetch_json(full_url, endpoint)
+            await asyncio.sleep(self.coordinator.poll_interval)
+
+        try:
+            return await self._fetch_json(full_url, endpoint)
+        finally:
+            await self.coordinator.release_lease(full_url)
+
+    async def invalidate(self, path: str, endpoint: str = "other"):
+        """Marks the cached response for the endpoint as expired so the next request revalidates it."""
+        full_url = self.base_url + path
+        self.metrics.inc("tba_invalidations_total", {"endpoint": endpoint})
+        self.response_cache.expire(full_url)
+        await self.disk_cache.expire(full_url)
+        if self.coordinator is not None:
+            await self.coordinator.publish_invalidation(full_url)
+
+    async def _follow_invalidations(self):
+        """Expires the in-memory copies of the responses other processes invalidate, e.g. from webhooks."""
+        last_id = None
+        while True:
+            try:
+                full_urls, last_id = await self.coordinator.invalidations_since(last_id)  # type: ignore
+                for full_url in full_urls:
+                    self.response_cache.expire(full_url)
+            except Exception:
+                traceback.print_exc()
+            await asyncio.sleep(self.coordinator.invalidation_interval)  # type: ignore
+
+    async def refresh(self, path: str, endpoint: str = "other") -> Any:
+        """Invalidates the endpoint and fetches it again, waiting for the new response."""
+        await self.invalidate(path, endpoint)
+        # get_json would serve the invalidated response while revalidating it in the background
+        return await asyncio.shield(self._start_fetch(self.base_url + path, endpoint))
+
+    def _decode(self, endpoint: str, body: bytes) -> Any:
+        """Decodes a response body and converts it to the form it is cached in."""
+        try:
+            data = json_backend.decode(body, RESPONSE_TYPES.get(endpoint) if self.validate else None)
+        except ValueError as error:
+            if not self.validate:
+                raise
+            # TBA's data is still usable when a field does not match the types, so report it and carry on
+            self.metrics.inc("tba_validation_errors_total", {"endpoint": endpoint})
+            print(f"{endpoint}: {error}", file=sys.stderr)
+            data = json_backend.loads(body)
+        decoder = self.decoders.get(endpoint)
+        return decoder(data) if decoder is not None and data is not None else data
+
+    def _remember(self, full_url: str, endpoint: str, etag: Optional[str], max_age: float,
+                  stored: Optional[StoredResponse] = None, body: Optional[bytes] = None) -> Any:
+        """Caches a response in memory, only decoding its body if it is not in memory already.
+
+        A response with the ETag of the one in memory keeps the decoded data, see ``get_json``.
+
+        Args:
+            full_url: the full URL of the endpoint
+            endpoint: the name of the endpoint
+            etag: the ETag of the response
+            max_age: the number of seconds the response stays fresh for
+            stored: the response from the disk cache, if the body is not given
+            body: the response body
+        """
+        entry = self.response_cache.peek(full_url)
+        if entry is not None and etag is not None and entry.etag == etag:
+            data, size = entry.data, entry.size
+        else:
+            if body is None:
+                body = stored.body  # type: ignore
+            data = self._decode(endpoint, body)
+            size = data.nbytes if isinstance(data, MatchTable) else len(body)
+        self.response_cache.put(full_url, data, size, max_age, etag)
+        return data
+
+    async def _fetch_json(self, full_url: str, endpoint: str, revalidate: bool = True) -> Any:
+        """Gets the full URL from the disk cache, or from TBA if it has expired, revalidating with ETags.
+
+        Args:
+            full_url: the full URL of the endpoint
+            endpoint: the name of the endpoint for metrics
+            revalidate: whether to send the stored ETag with the request
+        """
+        stored = await self.disk_cache.get(full_url)
+        if stored is not None and not stored.is_expired:
+            self.metrics.inc("tba_cache_total", {"result": "disk_hit"})
+            return self._remember(full_url, endpoint, stored.etag, stored.expires - time.time(), stored)
+
+        headers = self.headers
+        if revalidate and stored is not None and stored.etag is not None:
+            headers = {**headers, "If-None-Match": stored.etag}
+
+        # Requests to TBA draw from the budget shared with the other processes
+        if self.coordinator is not None:
+            waited = await self.coordinator.acquire_request()
+            if waited > 0:
+                self.metrics.observe("tba_budget_wait_seconds", waited, {"endpoint": endpoint})
+
+        start = time.perf_counter()
+        try:
+            response = await self.session.get(full_url, headers=headers)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.metrics.inc("tba_requests_total", {"endpoint": endpoint, "status": "error"})
+            raise
+        self.metrics.observe("tba_request_seconds", time.perf_counter() - start, {"endpoint": endpoint})
+        self.metrics.inc("tba_requests_total", {"endpoint": endpoint, "status": str(response.status)})
+
+        async with response:
+            if response.status == 200:
+                # There was new data
+                etag = response.headers.get("ETag")
+                body = await response.read()
+                data = self._remember(full_url, endpoint, etag, _max_age(response), body=body)
+                await self.disk_cache.put(full_url, body, etag, response.headers.get("Last-Modified"),
+                                          _max_age(response))
+                return data
+            elif response.status == 304 and stored is not None:
+                # The cache expired but the server said the data was not changed
+                self.metrics.inc("tba_cache_total", {"result": "revalidated"})
+                await self.disk_cache.revalidated(full_url, _max_age(response))
+                return self._remember(full_url, endpoint, stored.etag, _max_age(response), stored)
+            elif response.status == 304:
+                # Nothing to revalidate against, so download the data again
+                return await self._fetch_json(full_url, endpoint, revalidate=False)
+            elif response.status == 404:
+                raise FileNotFoundError("404 Not Found; check your parameters?")
+            else:
+                raise ConnectionError(f"Error accessing the TBA API; status code {response.status}.")
 
-async def team_events_year(team_key: str, year: int) -> list[Event]:
-    return await get_json(f"/team/{team_key}/events/{year}")
+    async def event_matches_simple(self, event_key: str) -> list[MatchSimple] | MatchTable:
+        return await self.get_json(f"/event/{event_key}/matches/simple", "event_matches_simple")
 
+    async def team_events_statuses(self, team_key: str, year: int) -> dict:
+        return await self.get_json(f"/team/{team_key}/events/{year}/statuses", "team_events_statuses")
 
-async def event_predictions(event_key: str) -> Optional[EventPredictions]:
-    return await get_json(f"/event/{event_key}/predictions")
+    async def team_events_year(self, team_key: str, year: int) -> list[Event]:
+        return await self.get_json(f"/team/{team_key}/events/{year}", "team_events_year")
 
+    async def team_events_year_keys(self, team_key: str, year: int) -> list[str]:
+        return await self.get_json(f"/team/{team_key}/events/{year}/keys", "team_events_year_keys")
 
-async def team_matches_year_simple(team_key: str, year: int) -> list[MatchSimple]:
-    return await get_json(f"/team/{team_key}/matches/{year}/simple")
+    async def events_year(self, year: int) -> list[Event]:
+        return await self.get_json(f"/events/{year}", "events_year")
 
+    async def event_teams_keys(self, event_key: str) -> list[str]:
+        return await self.get_json(f"/event/{event_key}/teams/keys", "event_teams_keys")
 
-async def team_event_matches(team_key: str, event_key: str):
-    return await get_json(f"/team/{team_key}/event/{event_key}/matches")
+    async def status(self) -> APIStatus:
+        return await self.get_json("/status", "status")
 
+    async def event_predictions(self, event_key: str) -> Optional[EventPredictions]:
+        return await self.get_json(f"/event/{event_key}/predictions", "event_predictions")
 
-async def event_oprs(event_key: str) -> EventOPRs:
-    return await get_json(f"/event/{event_key}/oprs")
+    async def team_matches_year_simple(self, team_key: str, year: int) -> list[MatchSimple] | MatchTable:
+        return await self.get_json(f"/team/{team_key}/matches/{year}/simple", "team_matches_year_simple")
 
+    async def team_event_matches(self, team_key: str, event_key: str):
+        return await self.get_json(f"/team/{team_key}/event/{event_key}/matches", "team_event_matches")
 
-async def event_rankings(event_key: str) -> EventRanking:
-    return await get_json(f"/event/{event_key}/rankings")
+    async def event_oprs(self, event_key: str) -> Optional[EventOPRs]:
+        return await self.get_json(f"/event/{event_key}/oprs", "event_oprs")
 
+    async def event_rankings(self, event_key: str) -> Optional[EventRanking]:
+        return await self.get_json(f"/event/{event_key}/rankings", "event_rankings")
 
-async def district_rankings(district_key: str) -> list[DistrictRanking]:
-    return await get_json(f"/district/{district_key}/rankings")
\ No newline at end of file
+    async def district_rankings(self, district_key: str) -> list[DistrictRanking]:
+        return await self.get_json(f"/district/{district_key}/rankings", "district_rankings")
@@ -0,0 +1,172 @@
+import asyncio
+import hashlib
+import hmac
+import re
+import sys
+import traceback
+from typing import Any, Optional
+
+import aiohttp
+from aiohttp import web
+
+from audeamus_bot.api import json_backend
+from audeamus_bot.api.tba_api import TBAClient
+from audeamus_bot.types.match_table import MatchTable
+
+
+# The TBA client endpoint each path a notification affects belongs to, so refreshes use its cache policy,
+# decoding and validation, and are labelled with it in the metrics
+PATH_ENDPOINTS = {
+    re.compile(r"/event/[^/]+/matches/simple"): "event_matches_simple",
+    re.compile(r"/event/[^/]+/rankings"): "event_rankings",
+    re.compile(r"/event/[^/]+/oprs"): "event_oprs",
+    re.compile(r"/event/[^/]+/predictions"): "event_predictions",
+    re.compile(r"/team/[^/]+/matches/\d+/simple"): "team_matches_year_simple",
+    re.compile(r"/team/[^/]+/events/\d+/statuses"): "team_events_statuses",
+}
+
+
+def path_endpoint(path: str) -> str:
+    """Gets the name of the TBA client endpoint a path belongs to."""
+    for pattern, endpoint in PATH_ENDPOINTS.items():
+        if pattern.fullmatch(path):
+            return endpoint
+    return "other"
+
+
+def sign(body: bytes, secret: str) -> str:
+    """Computes the ``X-TBA-HMAC`` header TBA sends with a webhook body."""
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def affected_paths(message_type: str, message_data: dict[str, Any]) -> tuple[list[str], list[str]]:
+    """Maps a webhook notification to the cached endpoints it makes out of date.
+
+    Args:
+        message_type: the ``message_type`` of the notification
+        message_data: the ``message_data`` of the notification
+
+    Returns:
+        The event endpoints and the team keys whose season matches and statuses are affected
+    """
+    event_key = message_data.get("event_key")
+    if event_key is None:
+        return [], []
+
+    if message_type == "match_score":
+        match = message_data.get("match") or {}
+        alliances = match.get("alliances") or {}
+        team_keys = [team_key for alliance in alliances.values() for team_key in alliance.get("team_keys", [])]
+        return ([f"/event/{event_key}/matches/simple", f"/event/{event_key}/rankings",
+                 f"/event/{event_key}/oprs", f"/event/{event_key}/predictions"],
+                team_keys)
+    elif message_type == "upcoming_match":
+        return ([f"/event/{event_key}/matches/simple", f"/event/{event_key}/predictions"],
+                message_data.get("team_keys", []))
+    elif message_type == "schedule_updated":
+        return [f"/event/{event_key}/matches/simple", f"/event/{event_key}/predictions"], []
+    elif message_type == "alliance_selection":
+        return [f"/event/{event_key}/matches/simple", f"/event/{event_key}/rankings"], []
+    else:
+        return [], []
+
+
+class WebhookReceiver:
+    """A small HTTP server that receives TBA webhooks and refreshes the affected cache entries.
+
+    Notifications are only accepted if their ``X-TBA-HMAC`` header matches the webhook secret.
+    Recorded payloads can be replayed against a local receiver with
+    ``python -m audeamus_bot.api.webhooks <url> <secret> <payload.json>``.
+
+    Args:
+        tba: the TBA client whose cache to update
+        secret: the webhook secret from the TBA account page
+        host: the interface to listen on
+        port: the port to listen on
+        path: the URL path TBA posts to
+        refresh: whether to fetch affected endpoints again right away instead of only invalidating them
+    """
+
+    def __init__(self, tba: TBAClient, secret: str, host: str = "0.0.0.0", port: int = 8080,
+                 path: str = "/tba", refresh: bool = True):
+        self.tba = tba
+        self.secret = secret
+        self.host = host
+        self.port = port
+        self.refresh = refresh
+
+        self.app = web.Application()
+        self.app.router.add_post(path, self.handle)
+        self.runner: Optional[web.AppRunner] = None
+
+        # Refreshes triggered by notifications, kept so they are not garbage collected
+        self.tasks: set[asyncio.Task] = set()
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        if not hmac.compare_digest(request.headers.get("X-TBA-HMAC", ""), sign(body, self.secret)):
+            return web.Response(status=401, text="Invalid HMAC")
+
+        try:
+            notification = json_backend.loads(body)
+            message_type = notification["message_type"]
+            message_data = notification.get("message_data") or {}
+        except (ValueError, KeyError, TypeError):
+            return web.Response(status=400, text="Invalid notification")
+
+        if message_type == "verification":
+            print(f"TBA webhook verification key: {message_data.get('verification_key')}")
+
+        # Answer TBA right away; the cache is updated in the background
+        task = asyncio.create_task(self.update_cache(message_type, message_data))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return web.Response(text="OK")
+
+    async def update_cache(self, message_type: str, message_data: dict[str, Any]):
+        event_paths, team_keys = affected_paths(message_type, message_data)
+        if len(event_paths) == 0:
+            return
+
+        try:
+            update = self.tba.refresh if self.refresh else self.tba.invalidate
+            results = await asyncio.gather(*(update(path, path_endpoint(path)) for path in event_paths),
+                                           return_exceptions=True)
+
+            # Schedule changes can affect every team at the event, so find them in the new schedule
+            if len(team_keys) == 0 and self.refresh and isinstance(results[0], MatchTable):
+                team_keys = results[0].team_keys
+            elif len(team_keys) == 0 and self.refresh and isinstance(results[0], list):
+                team_keys = {team_key for match in results[0] if match["alliances"] is not None
+                             for alliance in match["alliances"].values() for team_key in alliance["team_keys"]}
+
+            year = message_data["event_key"][:4]
+            await asyncio.gather(*(self.tba.invalidate(path, path_endpoint(path)) for team_key in team_keys
+                                   for path in (f"/team/{team_key}/matches/{year}/simple",
+                                                f"/team/{team_key}/events/{year}/statuses")))
+        except Exception:
+            traceback.print_exc()
+
+
+async def _post(url: str, secret: str, payload_file: str):
+    with open(payload_file, "rb") as file:
+        body = file.read()
+
+    async with aiohttp.ClientSession() as session:
+        async with session.post(url, data=body, headers={"Content-Type": "application/json",
+                                                         "X-TBA-HMAC": sign(body, secret)}) as response:
+            print(response.status, await response.text())
+
+
+if __name__ == "__main__":
+    asyncio.run(_post(*sys.argv[1:4]))
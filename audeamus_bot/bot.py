@@ -1,5 +1,13 @@
+from typing import Optional
+
+from audeamus_bot.analytics.simulation import RankingSimulator
 from audeamus_bot.commands.frc_command_tree import FRCCommandTree
-from audeamus_bot.api import tba_api
+from audeamus_bot.api.tba_api import TBAClient
+from audeamus_bot.api.webhooks import WebhookReceiver
+from audeamus_bot.helpers.event_calendar import EventCalendar
+from audeamus_bot.helpers.guild_config import GuildConfigStore
+from audeamus_bot.helpers.prefetch import Prefetcher
+from audeamus_bot.metrics import Metrics
 import discord
 
 intents = discord.Intents.default()
@@ -7,24 +15,99 @@ intents = discord.Intents.default()
 MAX_MATCHES_PER_PAGE = 8
 
 
-class AudeamusBot(discord.Client):
-    def __init__(self, team_number: int, guild: discord.Object, **kwargs):
+class AudeamusBot(discord.AutoShardedClient):
+    def __init__(self, team_number: Optional[int] = None, tba_options: Optional[dict] = None,
+                 prefetch: bool = False, webhook_options: Optional[dict] = None,
+                 metrics_port: Optional[int] = None, config_file: str = "guild_config.sqlite", **kwargs):
         super().__init__(intents=intents, **kwargs)
 
+        # The team used by servers that have not set their own with /frc setup
         self.team_number = team_number
-        self.guild = guild
+        self.guild_configs = GuildConfigStore(config_file, team_number)
+
+        # Served in the Prometheus format on the metrics port, if given
+        self.metrics = Metrics()
+        self.metrics_port = metrics_port
+
         self.tree = FRCCommandTree(self, team_number, MAX_MATCHES_PER_PAGE)
 
+        # Keyword arguments for the TBAClient, which is created once the event loop is running.
+        # Every server shares it, so servers following the same event share its cache.
+        self.tba_options = tba_options or {}
+        self.tba: Optional[TBAClient] = None
+
+        # The season's events by date, used to find the event a team is at; also created with the TBAClient
+        self.calendar: Optional[EventCalendar] = None
+
+        # Runs ranking simulations in worker processes, started on first use
+        self.simulator = RankingSimulator()
+
+        # Whether to keep the active events of the servers' teams warm in the cache in the background
+        self.prefetch = prefetch
+        self.prefetchers: dict[int, Prefetcher] = {}
+
+        # Keyword arguments for the WebhookReceiver; webhooks are only received if these are given
+        self.webhook_options = webhook_options
+        self.webhook_receiver: Optional[WebhookReceiver] = None
+
     async def setup_hook(self):
-        self.tree.copy_global_to(guild=self.guild)
-        await self.tree.sync(guild=self.guild)
+        self.tba = TBAClient(metrics=self.metrics, **self.tba_options)
+        await self.guild_configs.open()
+
+        self.calendar = EventCalendar(self.tba)
+        self.calendar.start()
+
+        # Processes sharing the cache take turns refreshing, so prefetching in each does not add TBA requests
+        await self.update_prefetchers()
+
+        if self.metrics_port is not None:
+            await self.metrics.start_server(port=self.metrics_port)
+
+        # With several processes, the one running the first shard does the work that only needs doing once
+        if not self.is_primary:
+            return
+
+        if self.webhook_options is not None:
+            self.webhook_receiver = WebhookReceiver(self.tba, **self.webhook_options)
+            await self.webhook_receiver.start()
+
+        await self.tree.sync()
+
+    @property
+    def is_primary(self) -> bool:
+        """Whether this process runs the first shard, or all of them."""
+        return self.shard_ids is None or 0 in self.shard_ids
+
+    async def update_prefetchers(self):
+        """Starts prefetching for teams servers have started following and stops it for the rest."""
+        if not self.prefetch:
+            return
+
+        team_numbers = await self.guild_configs.team_numbers()
+        for team_number in self.prefetchers.keys() - team_numbers:
+            await self.prefetchers.pop(team_number).stop()
+        for team_number in team_numbers - self.prefetchers.keys():
+            self.prefetchers[team_number] = Prefetcher(self.tba, team_number, self.calendar)  # type: ignore
+            self.prefetchers[team_number].start()
 
     async def on_ready(self):
         print(f"We have logged in as {self.user}")
 
+    async def on_app_command_completion(self, interaction: discord.Interaction, command):
+        self.tree.record_command(interaction)
+
     async def close(self):
         print("Closing")
 
-        if tba_api.session is not None:
-            await tba_api.session.close()
+        await self.metrics.stop_server()
+        for prefetcher in self.prefetchers.values():
+            await prefetcher.stop()
+        if self.webhook_receiver is not None:
+            await self.webhook_receiver.stop()
+        if self.calendar is not None:
+            await self.calendar.stop()
+        self.simulator.close()
+        if self.tba is not None:
+            await self.tba.close()
+        await self.guild_configs.close()
         await super().close()
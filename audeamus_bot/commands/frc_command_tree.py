@@ -1,16 +1,55 @@
+import time
+from typing import Optional
+
 from discord import app_commands
 import discord
 
+from audeamus_bot.api.tba_api import track_stale_responses
 from audeamus_bot.commands.frc_commands import FRCCommands
+from audeamus_bot.helpers import format
 
 
 class FRCCommandTree(app_commands.CommandTree):
-    def __init__(self, client: discord.Client, team_number: int, max_matches_per_page: int):
+    def __init__(self, client: discord.Client, team_number: Optional[int], max_matches_per_page: int):
         super().__init__(client)
-        self.add_command(FRCCommands(team_number, max_matches_per_page))
+        self.add_command(FRCCommands(client, team_number, max_matches_per_page))
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        # Each command tracks whether it had to use stale data
+        track_stale_responses()
+        interaction.extras["started"] = time.perf_counter()
+
+        if interaction.guild_id is None:
+            return True
+
+        # Commands use the server's team and season by default
+        config = interaction.extras["config"] = await self.client.guild_configs.get(interaction.guild_id)
+
+        # Admins can use commands anywhere, e.g. to change the allowed channels
+        if (len(config.channels) > 0 and interaction.channel_id not in config.channels
+                and not interaction.permissions.administrator):
+            await interaction.response.send_message(
+                f"Commands can only be used in {format.channel_list(config.channels)}.", ephemeral=True)
+            return False
+        return True
+
+    def record_command(self, interaction: discord.Interaction, error: bool = False):
+        """Records how long the command took, and whether it failed, in the bot's metrics."""
+        if interaction.command is None or "started" not in interaction.extras:
+            return
+
+        labels = {"command": interaction.command.name}
+        self.client.metrics.observe("command_seconds", time.perf_counter() - interaction.extras["started"], labels)
+        if error:
+            self.client.metrics.inc("command_errors_total", labels)
 
     async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        self.record_command(interaction, error=True)
         embed = discord.Embed(title="Command Error",
                               description="An error occurred. Make sure your parameters are correct.")
-        await interaction.response.send_message(embed=embed)
+        # The command may have already deferred its response
+        if interaction.response.is_done():
+            await interaction.followup.send(embed=embed)
+        else:
+            await interaction.response.send_message(embed=embed)
         await super().on_error(interaction, error)
@@ -1,31 +1,179 @@
+import asyncio
+import functools
+import re
 import time
-from datetime import datetime
+from collections.abc import Coroutine
+from dataclasses import dataclass
 from math import ceil
+from typing import TYPE_CHECKING, Any, Optional
 
 import discord
 from discord import app_commands
 
-from audeamus_bot.api import tba_api
+from audeamus_bot.analytics.opr import EventStatsCache
+from audeamus_bot.analytics.predictor import MatchPredictor
+from audeamus_bot.analytics.simulation import RankingSimulator
+from audeamus_bot.api.tba_api import TBAClient, stale_responses
 from audeamus_bot.helpers import format
+from audeamus_bot.helpers.compare import TeamSummary, summarize_teams
+from audeamus_bot.helpers.event_calendar import EventCalendar
+from audeamus_bot.helpers.event_snapshot import EventSnapshot, EventSnapshots
+from audeamus_bot.helpers.guild_config import GuildConfig
 from audeamus_bot.helpers.page import Page
+from audeamus_bot.types.team_timeline import TeamTimeline, TeamTimelines
+
+if TYPE_CHECKING:
+    from audeamus_bot.bot import AudeamusBot
+
+# Discord discards responses sent more than 3 seconds after the interaction was created
+RESPONSE_BUDGET = 2.0
+
+NO_TEAM_MESSAGE = "No team number given. A server admin can set this server's team with `/frc setup`."
+
+ADMIN_ONLY_MESSAGE = "Only server admins can use this command."
+
+# The most teams /frc compare fetches at once, and compares in total
+COMPARE_CONCURRENCY = 8
+MAX_COMPARE_TEAMS = 80
+
+# Seconds between edits while /frc compare streams in results, to stay within Discord's rate limits
+COMPARE_EDIT_INTERVAL = 1.0
+
+NO_EVENT_MESSAGE = "No event key given, and this server's team has no current or upcoming event this season."
+
+
+@dataclass
+class Reply:
+    """The message a command responds with."""
+    content: Optional[str] = None
+    embed: Optional[discord.Embed] = None
+    view: Optional[discord.ui.View] = None
+    ephemeral: bool = False
+
+    def message_kwargs(self) -> dict[str, Any]:
+        kwargs = {"content": self.content, "embed": self.embed, "view": self.view}
+        return {**{key: value for key, value in kwargs.items() if value is not None}, "ephemeral": self.ephemeral}
+
+
+def deadline_aware(callback=None, *, ephemeral: bool = False):
+    """Sends the Reply returned by a command, deferring it if it is not ready within the response budget.
+
+    Args:
+        callback: the command
+        ephemeral: whether the command replies only to its user, which a deferred reply has to know up front
+    """
+    if callback is None:
+        return functools.partial(deadline_aware, ephemeral=ephemeral)
+
+    @functools.wraps(callback)
+    async def wrapper(self: "FRCCommands", interaction: discord.Interaction, *args, **kwargs):
+        await self._respond(interaction, callback(self, interaction, *args, **kwargs), ephemeral)
+
+    return wrapper
 
 
 class FRCCommands(app_commands.Group):
     """Access FRC data and insights."""
 
-    def __init__(self, team_number: int, max_matches_per_page: int, *args, **kwargs):
+    def __init__(self, bot: "AudeamusBot", team_number: Optional[int], max_matches_per_page: int,
+                 response_budget: float = RESPONSE_BUDGET, *args, **kwargs):
         super().__init__(*args, **kwargs, name="frc")
 
+        self.bot = bot
         self.team_number = team_number
         self.max_matches_per_page = max_matches_per_page
+        self.response_budget = response_budget
+
+        # Each team's matches sorted by time, shared by schedule and history
+        self.timelines = TeamTimelines()
+
+        # Each event's OPRs, updated from its match scores as they are published
+        self.event_stats = EventStatsCache()
+        self.predictor = MatchPredictor(self.event_stats)
+
+        # Each event's data and the views of it, shared by the event commands
+        self.snapshots = EventSnapshots(self.event_stats, self.predictor)
+
+    @property
+    def tba(self) -> TBAClient:
+        return self.bot.tba  # type: ignore
+
+    @property
+    def simulator(self) -> RankingSimulator:
+        return self.bot.simulator
+
+    @property
+    def calendar(self) -> EventCalendar:
+        return self.bot.calendar  # type: ignore
+
+    def config(self, interaction: discord.Interaction) -> GuildConfig:
+        """Gets the settings of the server the command was used in, looked up by the command tree."""
+        return interaction.extras.get("config") or GuildConfig(self.team_number)
+
+    async def timeline(self, team_number: int, year: int) -> TeamTimeline:
+        team_key = f"frc{team_number}"
+        return self.timelines.get(team_key, year, await self.tba.team_matches_year_simple(team_key, year))
+
+    async def snapshot(self, event_key: str, *components: str) -> EventSnapshot:
+        return await self.snapshots.get(self.tba, event_key, *components)
+
+    async def default_event(self, interaction: discord.Interaction) -> Optional[str]:
+        """Gets the key of the event the server's team is at, or else its next event this season."""
+        team_number = self.config(interaction).team_number
+        if team_number is None:
+            return None
+        return await self.calendar.current_or_next_event(f"frc{team_number}")
+
+    async def _respond(self, interaction: discord.Interaction, reply: Coroutine[Any, Any, Reply],
+                       ephemeral: bool = False):
+        """Responds with the reply if it is ready in time, otherwise defers and sends it as a follow-up."""
+        name = interaction.command.name if interaction.command is not None else "unknown"
+
+        task = asyncio.create_task(reply)
+        elapsed = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+        try:
+            await asyncio.wait({task}, timeout=max(0.0, self.response_budget - elapsed))
+            if not task.done():
+                self.bot.metrics.inc("command_deferred_total", {"command": name})
+                await interaction.response.defer(ephemeral=ephemeral, thinking=True)
+            result = await task
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+
+        # Let the user know if TBA was down and cached data had to be used
+        if stale_responses.get() and result.embed is not None:
+            format.mark_stale(result.embed)
+
+        if interaction.extras.get("progress_shown"):
+            # Replace the partial result rather than sending a second message
+            await interaction.edit_original_response(content=result.content, embed=result.embed, view=result.view)
+        elif interaction.response.is_done():
+            await interaction.followup.send(**result.message_kwargs())
+        else:
+            await interaction.response.send_message(**result.message_kwargs())
 
-    @app_commands.command(description="Gets the events played by a specific team this year.")
-    @app_commands.describe(team_number="The team number", year="The year")
-    async def events(self, interaction: discord.Interaction, team_number: int = 0, year: int = datetime.now().year):
-        if team_number == 0:
-            team_number = self.team_number
+        # Let the page disable its buttons once it is closed
+        if isinstance(result.view, Page):
+            result.view.interaction = interaction
+
+    async def _show_progress(self, interaction: discord.Interaction, embed: discord.Embed):
+        """Shows a partial result in place of a deferred reply, until the command's reply replaces it."""
+        interaction.extras["progress_shown"] = True
+        await interaction.edit_original_response(embed=embed)
 
-        team_events_data = await tba_api.team_events_year(f"frc{team_number}", year)
+    @app_commands.command(description="Gets the events played by a specific team this year.")
+    @app_commands.describe(team_number="The team number (defaults to the server's team)",
+                           year="The year (defaults to the server's season)")
+    @deadline_aware
+    async def events(self, interaction: discord.Interaction, team_number: int = 0, year: int = 0):
+        config = self.config(interaction)
+        team_number = team_number or config.team_number
+        if team_number is None:
+            return Reply(NO_TEAM_MESSAGE)
+        year = year or config.season
+
+        team_events_data = await self.tba.team_events_year(f"frc{team_number}", year)
         team_events = [
             f"""**{event["name"]} ({event["key"]})**
                 *{event["start_date"]} - {event["end_date"]}{f' (Week {event["week"]})' if "week" in event else ""}*
@@ -35,79 +183,91 @@ class FRCCommands(app_commands.Group):
         description = "\n\n".join(team_events)
 
         embed = discord.Embed(title=f"Events - {team_number}", description=description)
-        await interaction.response.send_message(embed=embed)
+        return Reply(embed=embed)
 
     @app_commands.command(description="Gets the predicted final rankings for a specific event.")
-    @app_commands.describe(event_key="The event key")
-    async def predictions(self, interaction: discord.Interaction, event_key: str):
-        event_predictions_data = await tba_api.event_predictions(event_key)
-        if event_predictions_data is None or event_predictions_data["ranking_predictions"] is None:
-            await interaction.response.send_message("Predictions not available.")
-            return
+    @app_commands.describe(event_key="The event key (defaults to the team's current or next event)")
+    @deadline_aware
+    async def predictions(self, interaction: discord.Interaction, event_key: str = ""):
+        event_key = event_key or await self.default_event(interaction)
+        if not event_key:
+            return Reply(NO_EVENT_MESSAGE)
+
+        # TBA's match predictions are used once the event publishes them, and local ones until then
+        snapshot = await self.snapshot(event_key, "matches", "rankings", "predictions")
+        simulation = await self.simulator.simulate(event_key, snapshot.matches,  # type: ignore
+                                                   snapshot.match_predictions, snapshot.rankings)  # type: ignore
+        if simulation is None:
+            return Reply("Predictions not available.")
+
+        expected_ranks = simulation.expected_ranks()
+        top_probabilities = simulation.top_probabilities()
+        teams = sorted(range(len(simulation.teams)), key=expected_ranks.__getitem__)
+        num_pages = ceil(len(teams) / 25)
 
-        rankings = sorted(event_predictions_data["ranking_predictions"],
-                          key=lambda prediction: prediction[1][4], reverse=True)
+        def formatter(page: int):
+            embed = discord.Embed(title=f"Predictions - {event_key} - Page {page + 1}/{num_pages}",
+                                  description=f"From {simulation.runs} simulations of the remaining qualification "
+                                              "matches. Ranks shown are the 10th to 90th percentile.")
+            for rank, team in enumerate(teams[page * 25:(page + 1) * 25], start=(page * 25) + 1):
+                low, high = simulation.rank_range(team)
+                embed.add_field(name=f"{rank}. {simulation.teams[team][3:]}",
+                                value=f"Avg rank {expected_ranks[team]:.1f} ({low}-{high})\n"
+                                      f"Top 8: {top_probabilities[team]:.0%}")
+            return embed
 
-        embed = discord.Embed(title=f"Predictions - {event_key}")
-        for rank, team in enumerate(rankings, start=1):
-            embed.add_field(name=f"{rank}. {team[0][3:]}", value=f"{round(team[1][4])} RP")
-        await interaction.response.send_message(embed=embed)
+        if num_pages > 1:
+            view = Page(0, num_pages, formatter)
+            return Reply(embed=view.show(0), view=view)
+        else:
+            return Reply(embed=formatter(0))
 
     @app_commands.command(description="Gets the upcoming matches of a specific team.")
-    @app_commands.describe(team_number="The team number", year="The year")
-    async def schedule(self, interaction: discord.Interaction, team_number: int = 0, year: int = datetime.now().year):
-        if team_number == 0:
-            team_number = self.team_number
-
-        matches = await tba_api.team_matches_year_simple(
-            f"frc{team_number}", year)
-        next_matches = sorted(filter(lambda match: match["predicted_time"] is not None
-                                                   and time.time() < match["predicted_time"],
-                                     matches),
-                              key=lambda event: event["predicted_time"])  # type: ignore
+    @app_commands.describe(team_number="The team number (defaults to the server's team)",
+                           year="The year (defaults to the server's season)")
+    @deadline_aware
+    async def schedule(self, interaction: discord.Interaction, team_number: int = 0, year: int = 0):
+        config = self.config(interaction)
+        team_number = team_number or config.team_number
+        if team_number is None:
+            return Reply(NO_TEAM_MESSAGE)
+        year = year or config.season
+
+        next_matches = (await self.timeline(team_number, year)).upcoming(time.time())
 
         if len(next_matches) == 0:
-            await interaction.response.send_message(embed=discord.Embed(title="Upcoming Matches",
-                                                                        description="No scheduled matches."))
-            return
+            return Reply(embed=discord.Embed(title="Upcoming Matches", description="No scheduled matches."))
 
         current_event_key = next_matches[0]["event_key"]
-
-        predictions = await tba_api.event_predictions(current_event_key)
+        match_predictions = (await self.snapshot(current_event_key, "predictions", "matches")).match_predictions
 
         num_pages = ceil(len(next_matches) / self.max_matches_per_page)
 
         def formatter(page: int):
             page_matches = next_matches[page * self.max_matches_per_page:(page + 1) * self.max_matches_per_page]
-            if predictions is not None and ((match_predictions := predictions["match_predictions"]) is not None):
-                embed = format.format_matches(
-                    page_matches, f"Upcoming Matches - {team_number} - Page {page + 1}/{num_pages}", team_number,
-                    match_predictions)
-            else:
-                embed = format.format_matches(
-                    page_matches, f"Upcoming Matches - {team_number} - Page {page + 1}/{num_pages}", team_number)
+            embed = format.format_matches(
+                page_matches, f"Upcoming Matches - {team_number} - Page {page + 1}/{num_pages}", team_number,
+                match_predictions)
             return embed
 
         if num_pages > 1:
             view = Page(0, num_pages, formatter)
-            await interaction.response.send_message(embed=formatter(0), view=view)
+            return Reply(embed=view.show(0), view=view)
         else:
-            await interaction.response.send_message(embed=formatter(0))
+            return Reply(embed=formatter(0))
 
     @app_commands.command(description="Gets the past matches of a specific team.")
-    @app_commands.describe(team_number="The team number", year="The year")
-    async def history(self, interaction: discord.Interaction, team_number: int = 0, year: int = datetime.now().year):
-
-        if team_number == 0:
-            team_number = self.team_number
-
-        matches = await tba_api.team_matches_year_simple(
-            f"frc{team_number}", year)
-        previous_matches = sorted(filter(lambda match: match["predicted_time"] is not None
-                                                       and match["predicted_time"] < time.time(),
-                                         matches),
-                                  key=lambda match: match["predicted_time"],  # type: ignore
-                                  reverse=True)
+    @app_commands.describe(team_number="The team number (defaults to the server's team)",
+                           year="The year (defaults to the server's season)")
+    @deadline_aware
+    async def history(self, interaction: discord.Interaction, team_number: int = 0, year: int = 0):
+        config = self.config(interaction)
+        team_number = team_number or config.team_number
+        if team_number is None:
+            return Reply(NO_TEAM_MESSAGE)
+        year = year or config.season
+
+        previous_matches = (await self.timeline(team_number, year)).previous(time.time())
 
         num_pages = ceil(len(previous_matches) / self.max_matches_per_page)
 
@@ -119,43 +279,73 @@ class FRCCommands(app_commands.Group):
 
         if num_pages > 1:
             view = Page(0, num_pages, formatter)
-            await interaction.response.send_message(embed=formatter(0), view=view)
+            return Reply(embed=view.show(0), view=view)
         else:
-            await interaction.response.send_message(embed=formatter(0))
+            return Reply(embed=formatter(0))
+
+    @app_commands.command(description="Compares several teams' seasons side by side.")
+    @app_commands.describe(team_numbers="Team numbers, separated by spaces or commas (defaults to the event's teams)",
+                           event_key="The event to compare OPRs at, and whose teams to compare if none are given "
+                                     "(defaults to the team's current or next event)")
+    @deadline_aware
+    async def compare(self, interaction: discord.Interaction, team_numbers: str = "", event_key: str = ""):
+        config = self.config(interaction)
+        team_keys = [f"frc{number}" for number in dict.fromkeys(re.findall(r"\d+", team_numbers))]
+        event_key = event_key or (await self.default_event(interaction) if len(team_keys) == 0 else "")
+        if len(team_keys) == 0 and event_key:
+            team_keys = sorted(await self.tba.event_teams_keys(event_key), key=lambda team_key: int(team_key[3:]))
+        if len(team_keys) == 0:
+            return Reply(NO_EVENT_MESSAGE)
+        team_keys = team_keys[:MAX_COMPARE_TEAMS]
+
+        year = int(event_key[:4]) if event_key else config.season
+        title = f"Team Comparison - {event_key}" if event_key else "Team Comparison"
+
+        summaries: list[TeamSummary] = []
+        last_edit = time.perf_counter()
+        async for summary in summarize_teams(self.tba, self.event_stats, team_keys, year, event_key or None,
+                                             COMPARE_CONCURRENCY):
+            summaries.append(summary)
+            # Once the reply has been deferred, fill in the table as teams finish loading
+            if (interaction.response.is_done() and len(summaries) < len(team_keys)
+                    and time.perf_counter() - last_edit >= COMPARE_EDIT_INTERVAL):
+                await self._show_progress(interaction, format.format_comparison(summaries, title, len(team_keys)))
+                last_edit = time.perf_counter()
+
+        return Reply(embed=format.format_comparison(summaries, title, len(team_keys)))
 
     @app_commands.command(description="Creates a tier list for the event based on OPRs")
-    @app_commands.describe(event_key="The event key (ex: 2023onwin)")
-    async def tierlist(self, interaction: discord.Interaction, event_key: str):
-        tiers = ["S", "A", "B", "C", "D", "E", "F"]
-
-        oprs = await tba_api.event_oprs(event_key)
-        ccwms = sorted(oprs["ccwms"].items(), key=lambda item: item[1], reverse=True)
-
-        max_ccwm = max(oprs["ccwms"].values())
-        ccwm_range = max_ccwm - min(oprs["ccwms"].values())
-        breakpoints = [max_ccwm - ccwm_range / len(tiers) * i for i in range(1, len(tiers) + 1)]
-
-        tier_descriptions = []
-        j = 0
-        for i, tier in enumerate(tiers):
-            teams_in_tier = []
-            # Subtraction to deal with float inaccuracy
-            while j < len(ccwms) and ccwms[j][1] >= (breakpoints[i] - 0.001):
-                teams_in_tier.append(ccwms[j][0][3:])
-                j += 1
-            tier_descriptions.append(f"**{tier}**: {', '.join(teams_in_tier)}")
+    @app_commands.describe(event_key="The event key, e.g. 2023onwin (defaults to the team's current or next event)")
+    @deadline_aware
+    async def tierlist(self, interaction: discord.Interaction, event_key: str = ""):
+        event_key = event_key or await self.default_event(interaction)
+        if not event_key:
+            return Reply(NO_EVENT_MESSAGE)
+
+        # TBA's OPRs are only needed until a qualification match is scored
+        snapshot = await self.snapshot(event_key, "matches")
+        if not snapshot.stats:
+            await snapshot.load("oprs")
+        if not snapshot.ratings:
+            return Reply("OPRs not available.")
+        tier_descriptions = [f"**{tier}**: {', '.join(teams_in_tier)}" for tier, teams_in_tier in snapshot.tiers]
 
         description = ("The following values are based on CCWM - Calculated Contribution to Winning Margin.\n\n"
                        + "\n".join(tier_descriptions))
 
-        await interaction.response.send_message(embed=discord.Embed(title=f"Tier List - {event_key}",
-                                                                    description=description))
+        return Reply(embed=discord.Embed(title=f"Tier List - {event_key}", description=description))
 
     @app_commands.command(description="Shows the rankings at a specified event")
-    @app_commands.describe(event_key="The event key (ex: 2023onwin)")
-    async def event_rankings(self, interaction: discord.Interaction, event_key: str):
-        rankings = await tba_api.event_rankings(event_key)
-        sorted_teams = sorted(rankings["rankings"], key=lambda team: team["rank"])
+    @app_commands.describe(event_key="The event key, e.g. 2023onwin (defaults to the team's current or next event)")
+    @deadline_aware
+    async def event_rankings(self, interaction: discord.Interaction, event_key: str = ""):
+        event_key = event_key or await self.default_event(interaction)
+        if not event_key:
+            return Reply(NO_EVENT_MESSAGE)
+
+        sorted_teams = (await self.snapshot(event_key, "rankings")).sorted_rankings
+        if len(sorted_teams) == 0:
+            return Reply("Rankings not available.")
         num_pages = ceil(len(sorted_teams) / 25)
 
         def formatter(page: int):
@@ -169,14 +359,15 @@ class FRCCommands(app_commands.Group):
 
         if num_pages > 1:
             view = Page(0, num_pages, formatter)
-            await interaction.response.send_message(embed=formatter(0), view=view)
+            return Reply(embed=view.show(0), view=view)
         else:
-            await interaction.response.send_message(embed=formatter(0))
+            return Reply(embed=formatter(0))
 
     @app_commands.command(description="Shows the rankings of a specified district")
     @app_commands.describe(district_key="The district key (ex: 2023ont)")
+    @deadline_aware
     async def district_rankings(self, interaction: discord.Interaction, district_key: str):
-        rankings = await tba_api.district_rankings(district_key)
+        rankings = await self.tba.district_rankings(district_key)
         sorted_teams = sorted(rankings, key=lambda team: team["rank"])
 
         num_pages = ceil(len(sorted_teams)/25)
@@ -192,22 +383,59 @@ class FRCCommands(app_commands.Group):
 
         if num_pages > 1:
             view = Page(0, num_pages, formatter)
-            await interaction.response.send_message(embed=formatter(0), view=view)
+            return Reply(embed=view.show(0), view=view)
         else:
-            await interaction.response.send_message(embed=formatter(0))
+            return Reply(embed=formatter(0))
+
+    @app_commands.command(description="Shows TBA request, cache and command statistics (admins only)")
+    @deadline_aware(ephemeral=True)
+    async def stats(self, interaction: discord.Interaction):
+        if not interaction.permissions.administrator:
+            return Reply(ADMIN_ONLY_MESSAGE, ephemeral=True)
+        return Reply(embed=format.format_stats(self.bot.metrics), ephemeral=True)
+
+    @app_commands.command(description="Sets this server's team and season (admins only)")
+    @app_commands.describe(team_number="The team commands default to",
+                           year="The season commands default to (0 to follow the current year)")
+    @app_commands.guild_only()
+    @deadline_aware(ephemeral=True)
+    async def setup(self, interaction: discord.Interaction, team_number: int, year: int = 0):
+        if not interaction.permissions.administrator:
+            return Reply(ADMIN_ONLY_MESSAGE, ephemeral=True)
+
+        config = await self.bot.guild_configs.update(interaction.guild_id, team_number=team_number,  # type: ignore
+                                                     year=year or None)
+        await self.bot.update_prefetchers()
+        return Reply(f"This server now follows team {config.team_number} in "
+                     f"{config.year if config.year is not None else 'the current season'}.", ephemeral=True)
+
+    @app_commands.command(description="Allows or disallows commands in a channel (admins only)")
+    @app_commands.describe(channel="The channel",
+                           allowed="Whether commands can be used there; once any channel is allowed, others are not")
+    @app_commands.guild_only()
+    @deadline_aware(ephemeral=True)
+    async def channel(self, interaction: discord.Interaction, channel: discord.TextChannel, allowed: bool = True):
+        if not interaction.permissions.administrator:
+            return Reply(ADMIN_ONLY_MESSAGE, ephemeral=True)
+
+        channels = self.config(interaction).channels
+        channels = channels | {channel.id} if allowed else channels - {channel.id}
+        await self.bot.guild_configs.update(interaction.guild_id, channels=channels)  # type: ignore
+        if len(channels) == 0:
+            return Reply("Commands can now be used in every channel.", ephemeral=True)
+        return Reply(f"Commands can now be used in {format.channel_list(channels)}.", ephemeral=True)
 
     # @app_commands.command(description="Gets the playoff bracket of a specific event.")
     # @app_commands.describe(event_key="The event key")
     # async def bracket(self, interaction: discord.Interaction, event_key: str):
-    #     matches = await tba_api.event_matches_simple(event_key)
+    #     matches = await self.tba.event_matches_simple(event_key)
     #     playoff_matches = sorted(filter(lambda match: match["comp_level"] != "qm", matches),
     #                              key=lambda match: match["set_number"])
     #
     #     if len(playoff_matches) == 0:
     #         embed = discord.Embed(title="Playoff Bracket",
     #                               description="No matches found.")
-    #         await interaction.response.send_message(embed=embed)
-    #         return
+    #         return Reply(embed=embed)
     #
     #     if len(playoff_matches) >= 14:
     #         num_pages = 8
@@ -254,6 +482,6 @@ class FRCCommands(app_commands.Group):
     #
     #     if num_pages > 1:
     #         view = Page(0, num_pages, formatter)
-    #         await interaction.response.send_message(embed=formatter(0), view=view)
+    #         return Reply(embed=formatter(0), view=view)
     #     else:
-    #         await interaction.response.send_message(embed=formatter(0))
+    #         return Reply(embed=formatter(0))
@@ -0,0 +1,123 @@
+import asyncio
+from collections.abc import AsyncIterator, Awaitable
+from dataclasses import dataclass
+from typing import Optional, TypeVar
+
+from audeamus_bot.analytics.opr import EventStatsCache
+from audeamus_bot.api.tba_api import TBAClient
+
+T = TypeVar("T")
+
+
+@dataclass
+class TeamSummary:
+    """A team's season at a glance, for comparing teams side by side.
+
+    Args:
+        team_key: the team
+        wins: the matches its alliance won this season
+        losses: the matches its alliance lost
+        ties: the matches its alliance tied
+        average_score: its alliances' average score
+        best_rank: its best qualification rank this season
+        events: the number of events it is registered for
+        opr: its OPR at ``opr_event_key``
+        opr_event_key: the event compared at, or else its latest event
+        error: why the team could not be summarized, if it could not
+    """
+    team_key: str
+    wins: int = 0
+    losses: int = 0
+    ties: int = 0
+    average_score: Optional[float] = None
+    best_rank: Optional[int] = None
+    events: int = 0
+    opr: Optional[float] = None
+    opr_event_key: Optional[str] = None
+    error: Optional[str] = None
+
+
+async def summarize_teams(tba: TBAClient, event_stats: EventStatsCache, team_keys: list[str], year: int,
+                          event_key: Optional[str] = None, concurrency: int = 8) -> AsyncIterator[TeamSummary]:
+    """Summarizes many teams at once, yielding each summary as soon as it is ready.
+
+    Each team's season matches and event statuses are fetched concurrently, with at most ``concurrency``
+    requests in flight between all teams. OPRs are computed locally from the event's matches, which are
+    only fetched once per event.
+
+    Args:
+        tba: the TBA client
+        event_stats: the cache of events' OPRs
+        team_keys: the teams
+        year: the season
+        event_key: the event to compare OPRs at, or None for each team's latest event
+        concurrency: the maximum number of requests in flight
+    """
+    semaphore = asyncio.BoundedSemaphore(concurrency)
+    event_matches: dict[str, asyncio.Task] = {}
+
+    async def limited(request: Awaitable[T]) -> T:
+        async with semaphore:
+            return await request
+
+    async def event_opr(opr_event_key: str, team_key: str) -> Optional[float]:
+        if opr_event_key not in event_matches:
+            event_matches[opr_event_key] = asyncio.ensure_future(limited(tba.event_matches_simple(opr_event_key)))
+        stats = event_stats.get(opr_event_key, await event_matches[opr_event_key])
+        index = stats.team_indices.get(team_key)
+        return float(stats.ratings[index, 0]) if index is not None and len(stats) > 0 else None
+
+    async def summarize(team_key: str) -> TeamSummary:
+        summary = TeamSummary(team_key)
+        try:
+            matches, statuses = await asyncio.gather(limited(tba.team_matches_year_simple(team_key, year)),
+                                                     limited(tba.team_events_statuses(team_key, year)))
+        except FileNotFoundError:
+            summary.error = "not found"
+            return summary
+        except Exception:
+            summary.error = "unavailable"
+            return summary
+
+        scores = []
+        latest_time, latest_event_key = -1, None
+        for match in matches:
+            alliances = match["alliances"]
+            if alliances is None or alliances["red"]["score"] is None or alliances["red"]["score"] < 0:
+                continue
+            color = "red" if team_key in alliances["red"]["team_keys"] else "blue"
+            scores.append(alliances[color]["score"])
+            if match["winning_alliance"] == color:
+                summary.wins += 1
+            elif match["winning_alliance"]:
+                summary.losses += 1
+            else:
+                summary.ties += 1
+
+            match_time = match["actual_time"] or match["time"] or 0
+            if match_time >= latest_time:
+                latest_time, latest_event_key = match_time, match["event_key"]
+        if len(scores) > 0:
+            summary.average_score = sum(scores) / len(scores)
+
+        summary.events = len(statuses)
+        ranks = [status["qual"]["ranking"]["rank"] for status in statuses.values()
+                 if status is not None and status.get("qual") and status["qual"].get("ranking")
+                 and status["qual"]["ranking"].get("rank") is not None]
+        summary.best_rank = min(ranks, default=None)
+
+        summary.opr_event_key = event_key or latest_event_key
+        if summary.opr_event_key is not None:
+            # The rest of the summary is still worth showing without an OPR
+            try:
+                summary.opr = await event_opr(summary.opr_event_key, team_key)
+            except Exception:
+                pass
+        return summary
+
+    # Every team's OPR waits on the event's matches, so they go first
+    if event_key is not None:
+        event_matches[event_key] = asyncio.ensure_future(limited(tba.event_matches_simple(event_key)))
+
+    for summary in asyncio.as_completed([summarize(team_key) for team_key in team_keys]):
+        yield await summary
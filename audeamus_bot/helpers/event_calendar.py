@@ -0,0 +1,205 @@
+import asyncio
+import bisect
+import time
+import traceback
+from datetime import date, datetime, timedelta, timezone, tzinfo
+from typing import Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from audeamus_bot.api.tba_api import TBAClient
+from audeamus_bot.types.tba_types import Event
+
+
+def _zone(name: Optional[str]) -> tzinfo:
+    """Gets an event's time zone, falling back to UTC for events without a known one."""
+    if name is None:
+        return timezone.utc
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return timezone.utc
+
+
+def event_interval(event: Event) -> tuple[float, float]:
+    """Gets the timestamps of the start of the event's first day and the end of its last, in its time zone."""
+    zone = _zone(event["timezone"])
+    start = datetime.combine(date.fromisoformat(event["start_date"]), datetime.min.time(), zone)
+    # The end date is the last day of the event, so include all of it
+    end = datetime.combine(date.fromisoformat(event["end_date"]) + timedelta(days=1), datetime.min.time(), zone)
+    return start.timestamp(), end.timestamp()
+
+
+class EventCalendar:
+    """An index of the current season's events by when they run.
+
+    The season comes from TBA's ``/status`` and the events from ``/events/{year}``, whose dates are
+    read in each event's own time zone. Events are kept sorted by start, so finding the events running
+    at a time, or a team's current or next event, is a binary search with no request once the team's
+    event keys have been loaded.
+
+    The index is refreshed in the background while ``start`` has been called. Unchanged responses leave
+    it as it is, and changes to events that keep their dates only replace the event data.
+
+    Args:
+        tba: the TBA client to load events through
+        year: the season to index, or None to follow TBA's current season
+        refresh_interval: seconds between refreshes
+    """
+
+    def __init__(self, tba: TBAClient, year: Optional[int] = None, refresh_interval: float = 6 * 60 * 60):
+        self.tba = tba
+        self.fixed_year = year
+        self.refresh_interval = refresh_interval
+
+        self.year: Optional[int] = None
+        self.events: dict[str, Event] = {}
+
+        # Event keys sorted by start, with the start and end timestamps at the same positions
+        self.keys: list[str] = []
+        self.starts: list[float] = []
+        self.ends: list[float] = []
+        self.intervals: dict[str, tuple[float, float]] = {}
+
+        # The longest event, which bounds how far back an event still running can have started
+        self.max_duration = 0.0
+
+        # The response the index was built from
+        self.source: Optional[list[Event]] = None
+
+        # Each loaded team's event keys, and their positions in the index, built on first lookup
+        self.team_keys: dict[str, list[str]] = {}
+        self.team_positions: dict[str, list[int]] = {}
+
+        self.lock = asyncio.Lock()
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                traceback.print_exc()
+            await asyncio.sleep(self.refresh_interval)
+
+    async def refresh(self) -> bool:
+        """Reloads the season's events and the loaded teams' event keys.
+
+        Returns:
+            Whether the index changed
+        """
+        async with self.lock:
+            year = self.fixed_year
+            if year is None:
+                year = (await self.tba.status())["current_season"]
+
+            events = await self.tba.events_year(year)
+            changed = events is not self.source or year != self.year
+            if changed:
+                self._update(year, events)
+
+            team_keys = await asyncio.gather(*(self.tba.team_events_year_keys(team_key, year)
+                                               for team_key in self.team_keys))
+            for team_key, keys in zip(list(self.team_keys), team_keys):
+                if keys is not self.team_keys[team_key]:
+                    self.team_keys[team_key] = keys
+                    self.team_positions.pop(team_key, None)
+                    changed = True
+            return changed
+
+    def _update(self, year: int, events: list[Event]):
+        intervals = {event["key"]: event_interval(event) for event in events}
+        self.source = events
+        self.events = {event["key"]: event for event in events}
+        if year != self.year:
+            self.team_keys.clear()
+        self.year = year
+
+        # Most refreshes only change event details, so only re-sort when dates were added, moved or removed
+        if intervals == self.intervals:
+            return
+
+        self.intervals = intervals
+        self.keys = sorted(intervals, key=intervals.__getitem__)
+        self.starts = [intervals[key][0] for key in self.keys]
+        self.ends = [intervals[key][1] for key in self.keys]
+        self.max_duration = max((end - start for start, end in intervals.values()), default=0.0)
+        self.team_positions.clear()
+
+    async def load(self):
+        """Builds the index if it has not been built yet."""
+        if self.year is None:
+            await self.refresh()
+
+    async def load_team(self, team_key: str):
+        """Loads the keys of the team's events this season if they have not been loaded yet."""
+        await self.load()
+        if team_key not in self.team_keys:
+            self.team_keys[team_key] = await self.tba.team_events_year_keys(team_key, self.year)  # type: ignore
+
+    def _positions(self, team_key: str) -> list[int]:
+        positions = self.team_positions.get(team_key)
+        if positions is None:
+            index = {key: position for position, key in enumerate(self.keys)}
+            positions = self.team_positions[team_key] = sorted(index[key] for key in self.team_keys.get(team_key, ())
+                                                               if key in index)
+        return positions
+
+    def active(self, now: Optional[float] = None) -> list[Event]:
+        """Gets the events running at the time, latest start first."""
+        now = time.time() if now is None else now
+        low = bisect.bisect_left(self.starts, now - self.max_duration)
+        high = bisect.bisect_right(self.starts, now)
+        return [self.events[self.keys[position]] for position in range(high - 1, low - 1, -1)
+                if now < self.ends[position]]
+
+    def team_active(self, team_key: str, now: Optional[float] = None) -> list[Event]:
+        """Gets the loaded team's events running at the time, latest start first."""
+        now = time.time() if now is None else now
+        positions = self._positions(team_key)
+        high = bisect.bisect_left(positions, bisect.bisect_right(self.starts, now))
+
+        events = []
+        for position in reversed(positions[:high]):
+            if self.starts[position] < now - self.max_duration:
+                break
+            if now < self.ends[position]:
+                events.append(self.events[self.keys[position]])
+        return events
+
+    def team_next(self, team_key: str, now: Optional[float] = None) -> Optional[Event]:
+        """Gets the loaded team's first event starting after the time."""
+        now = time.time() if now is None else now
+        positions = self._positions(team_key)
+        index = bisect.bisect_left(positions, bisect.bisect_right(self.starts, now))
+        return self.events[self.keys[positions[index]]] if index < len(positions) else None
+
+    async def current_event(self, team_key: str, now: Optional[float] = None) -> Optional[str]:
+        """Gets the key of the event the team is competing at, if any.
+
+        When the team is at several events at once, e.g. a championship division and its finals,
+        the one that started last is used.
+        """
+        await self.load_team(team_key)
+        events = self.team_active(team_key, now)
+        return events[0]["key"] if len(events) > 0 else None
+
+    async def current_or_next_event(self, team_key: str, now: Optional[float] = None) -> Optional[str]:
+        """Gets the key of the event the team is competing at, or else its next event this season."""
+        event_key = await self.current_event(team_key, now)
+        if event_key is None:
+            event = self.team_next(team_key, now)
+            event_key = event["key"] if event is not None else None
+        return event_key
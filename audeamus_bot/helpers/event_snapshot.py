@@ -0,0 +1,140 @@
+import asyncio
+from typing import Optional
+
+from audeamus_bot.analytics.opr import EventStats, EventStatsCache
+from audeamus_bot.analytics.predictor import MatchPredictor
+from audeamus_bot.api.tba_api import TBAClient
+from audeamus_bot.types.lru_cache import LRUCache
+from audeamus_bot.types.match_table import Matches
+from audeamus_bot.types.tba_types import (EventOPRs, EventPredictions, EventRanking, EventRankingTeam,
+                                          MatchPredictions)
+
+# The TBA responses an event snapshot is made of
+COMPONENTS = ("matches", "rankings", "predictions", "oprs")
+
+TIERS = ["S", "A", "B", "C", "D", "E", "F"]
+
+
+def ccwm_tiers(ccwms: dict[str, float], tiers: list[str] = TIERS) -> list[tuple[str, list[str]]]:
+    """Splits teams into tiers of equal CCWM range, best first.
+
+    Returns:
+        Each tier's name and the numbers of its teams, highest CCWM first
+    """
+    ranked = sorted(ccwms.items(), key=lambda item: item[1], reverse=True)
+    if len(ranked) == 0:
+        return [(tier, []) for tier in tiers]
+
+    max_ccwm = ranked[0][1]
+    ccwm_range = max_ccwm - ranked[-1][1]
+    breakpoints = [max_ccwm - ccwm_range / len(tiers) * i for i in range(1, len(tiers) + 1)]
+
+    result = []
+    j = 0
+    for i, tier in enumerate(tiers):
+        teams_in_tier = []
+        # Subtraction to deal with float inaccuracy
+        while j < len(ranked) and ranked[j][1] >= (breakpoints[i] - 0.001):
+            teams_in_tier.append(ranked[j][0][3:])
+            j += 1
+        result.append((tier, teams_in_tier))
+    return result
+
+
+class EventSnapshot:
+    """An event's TBA data and the views event commands show of it, shared between commands.
+
+    ``load`` fetches the components a command needs concurrently and only rebuilds the views of the
+    components whose responses changed.
+
+    Args:
+        tba: the TBA client
+        event_key: the event
+        stats_cache: the cache of events' ratings, updated from the matches
+        predictor: the local match predictor, used when TBA has no predictions
+    """
+
+    def __init__(self, tba: TBAClient, event_key: str, stats_cache: EventStatsCache, predictor: MatchPredictor):
+        self.tba = tba
+        self.event_key = event_key
+        self.stats_cache = stats_cache
+        self.predictor = predictor
+
+        # The latest response for each component, or None until it is loaded
+        self.matches: Optional[Matches] = None
+        self.rankings: Optional[EventRanking] = None
+        self.predictions: Optional[EventPredictions] = None
+        self.oprs: Optional[EventOPRs] = None
+
+        # The ratings computed from the matches' scores
+        self.stats: Optional[EventStats] = None
+
+        # Views combining components, rebuilt when any of them changes
+        self.sorted_rankings: list[EventRankingTeam] = []
+        self.ratings: Optional[EventOPRs] = None
+        self.tiers: list[tuple[str, list[str]]] = []
+        self.match_predictions: Optional[MatchPredictions] = None
+
+    async def load(self, *components: str):
+        """Brings the given components up to date at once, or every component if none are given."""
+        components = components or COMPONENTS
+        fetchers = {"matches": self.tba.event_matches_simple, "rankings": self.tba.event_rankings,
+                    "predictions": self.tba.event_predictions, "oprs": self.tba.event_oprs}
+        responses = await asyncio.gather(*(fetchers[component](self.event_key) for component in components))
+
+        changed = {component for component, response in zip(components, responses)
+                   if response is not getattr(self, component)}
+        for component in changed:
+            setattr(self, component, responses[components.index(component)])
+
+        if "matches" in changed:
+            self.stats = self.stats_cache.get(self.event_key, self.matches)  # type: ignore
+        if "rankings" in changed:
+            rankings = self.rankings["rankings"] if self.rankings is not None else None
+            self.sorted_rankings = sorted(rankings or [], key=lambda team: team["rank"])
+        if changed & {"matches", "oprs"}:
+            self._update_ratings()
+        if changed & {"matches", "predictions"}:
+            self._update_match_predictions()
+
+    def _update_ratings(self):
+        # TBA publishes its OPRs late and in batches, so they are only used until a qualification match is scored
+        if self.stats is not None and len(self.stats) > 0:
+            self.ratings = self.stats.oprs()
+        else:
+            self.ratings = self.oprs
+        self.tiers = ccwm_tiers(self.ratings["ccwms"]) if self.ratings else []
+
+    def _update_match_predictions(self):
+        if self.predictions is not None and self.predictions["match_predictions"] is not None:
+            self.match_predictions = self.predictions["match_predictions"]
+        elif self.matches is not None:
+            # TBA has no predictions early in an event or for offseason events, so predict from the played matches
+            self.match_predictions = self.predictor.get(self.event_key, self.matches)
+        else:
+            self.match_predictions = None
+
+
+class EventSnapshots:
+    """The snapshots of the events most recently looked up, by event key.
+
+    Args:
+        stats_cache: the cache of events' ratings
+        predictor: the local match predictor
+        max_entries: the maximum number of snapshots to keep
+    """
+
+    def __init__(self, stats_cache: EventStatsCache, predictor: MatchPredictor, max_entries: int = 256):
+        self.stats_cache = stats_cache
+        self.predictor = predictor
+        self._snapshots: LRUCache[str, EventSnapshot] = LRUCache(max_entries)
+
+    async def get(self, tba: TBAClient, event_key: str, *components: str) -> EventSnapshot:
+        """Gets the event's snapshot, with the given components, or every component, brought up to date."""
+        snapshot = self._snapshots.get(event_key)
+        if snapshot is None:
+            snapshot = EventSnapshot(tba, event_key, self.stats_cache, self.predictor)
+            self._snapshots.put(event_key, snapshot)
+
+        await snapshot.load(*components)
+        return snapshot
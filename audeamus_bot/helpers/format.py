@@ -1,59 +1,108 @@
+from collections.abc import Iterable
 from datetime import datetime
+from functools import lru_cache
 from typing import Optional
 
 import discord
 
-from audeamus_bot.api import tba_api
-from audeamus_bot.types.tba_types import MatchPredictions, MatchSimple
+from audeamus_bot.helpers.compare import TeamSummary
+from audeamus_bot.metrics import Metrics
+from audeamus_bot.types.team_timeline import match_time
+from audeamus_bot.types.tba_types import MatchPredictions, MatchSimple, SingleMatchPrediction
 
+STALE_NOTICE = "The Blue Alliance is unavailable, so some data may be out of date."
 
-def format_matches(matches: list[MatchSimple], title: str, team_number: int = 0,
+
+def mark_stale(embed: discord.Embed) -> discord.Embed:
+    if embed.footer.text:
+        return embed.set_footer(text=f"{embed.footer.text}\n{STALE_NOTICE}")
+    return embed.set_footer(text=STALE_NOTICE)
+
+
+# Names of the double elimination playoff rounds by set number
+PLAYOFF_ROUND_NAMES = {
+    1: "Upper Quarterfinals", 2: "Upper Quarterfinals", 3: "Upper Quarterfinals", 4: "Upper Quarterfinals",
+    5: "Lower Round 1", 6: "Lower Round 1",
+    7: "Upper Semifinals", 8: "Upper Semifinals",
+    9: "Lower Round 2", 10: "Lower Round 2",
+    11: "Upper Finals",
+    12: "Lower Round 3",
+    13: "Lower Finals",
+    14: "Finals",
+}
+
+
+def format_time(timestamp: int) -> str:
+    """Formats a match time to the minute."""
+    return _format_minute(timestamp // 60)
+
+
+@lru_cache(maxsize=4096)
+def _format_minute(minute: int) -> str:
+    """Formats a time given in minutes since the epoch, so times in the same minute share an entry."""
+    return datetime.fromtimestamp(minute * 60).strftime("%a %I:%M %p")
+
+
+@lru_cache(maxsize=4096)
+def team_label(team_key: str, highlighted_key: str) -> str:
+    """Gets the team number for a team key, underlined if it is the highlighted team."""
+    return f"__{team_key[3:]}__" if team_key == highlighted_key else team_key[3:]
+
+
+def match_name(match: MatchSimple) -> str:
+    if match["comp_level"] == "qm":
+        return f"Qualification {match['match_number']}"
+    elif match["comp_level"] == "sf":
+        return f"{PLAYOFF_ROUND_NAMES.get(match['set_number'], 'Playoff Match')} ({match['set_number']})"
+    elif match["comp_level"] == "f":
+        return f"Finals {match['match_number']}"
+    else:
+        return "Match"
+
+
+def match_prediction(match: MatchSimple,
+                     predictions: Optional[MatchPredictions]) -> Optional[SingleMatchPrediction]:
+    if predictions is None:
+        return None
+    # Predictions only cover one event, so other events' matches are missing
+    return predictions["qual" if match["comp_level"] == "qm" else "playoff"].get(match["key"])
+
+
+def format_matches(matches: Iterable[MatchSimple], title: str, team_number: int = 0,
                    predictions: Optional[MatchPredictions] = None) -> discord.Embed:
     embed = discord.Embed(title=title)
     last_event_key = ""
+    highlighted_key = f"frc{team_number}"
 
     for match in matches:
         if match["event_key"] != last_event_key:
             embed.add_field(name=f"__**{match['event_key']}**__", value="")
             last_event_key = match['event_key']
 
-        if match["predicted_time"] is None:
-            time_text = ""
-        else:
-            time_text = datetime.fromtimestamp(
-                match["predicted_time"]).strftime("%a %I:%M %p")
+        # The same time the match is sorted by in the team's timeline
+        timestamp = match_time(match)
+        time_text = "" if timestamp is None else format_time(timestamp)
 
-        if match["alliances"] is None:
+        alliances = match["alliances"]
+        if alliances is None:
             alliances_text = ""
         else:
-            red_alliance = [(team_key[3:] if str(team_number) != team_key[3:]
-                             else f"__{team_key[3:]}__")
-                            for team_key in match["alliances"]["red"]["team_keys"]]
-            blue_alliance = [(team_key[3:] if str(team_number) != team_key[3:]
-                              else f"__{team_key[3:]}__")
-                             for team_key in match["alliances"]["blue"]["team_keys"]]
+            red_alliance = "-".join([team_label(team_key, highlighted_key)
+                                     for team_key in alliances["red"]["team_keys"]])
+            blue_alliance = "-".join([team_label(team_key, highlighted_key)
+                                      for team_key in alliances["blue"]["team_keys"]])
 
             # If the match score has been updated
-            if match["alliances"]["red"]["score"] != -1:
-                red_points = match["alliances"]["red"]["score"]
-                blue_points = match["alliances"]["blue"]["score"]
-                red_alliance_text = f"{'-'.join(red_alliance)} ({red_points})"
-                blue_alliance_text = f"({blue_points}) {'-'.join(blue_alliance)}"
+            if alliances["red"]["score"] != -1:
+                red_alliance_text = f"{red_alliance} ({alliances['red']['score']})"
+                blue_alliance_text = f"({alliances['blue']['score']}) {blue_alliance}"
                 if match["winning_alliance"] == "red":
                     red_alliance_text = f"**{red_alliance_text}**"
                 elif match["winning_alliance"] == "blue":
                     blue_alliance_text = f"**{blue_alliance_text}**"
-            elif predictions is not None:  # If predictions are available
-                if match["comp_level"] == "qm":
-                    prediction = predictions["qual"][match["key"]]
-                else:
-                    prediction = predictions["playoff"][match["key"]]
-
-                red_points = round(prediction["red"]["score"])
-                blue_points = round(prediction["blue"]["score"])
-
-                red_alliance_text = f"{'-'.join(red_alliance)} ({red_points}\\*)"
-                blue_alliance_text = f"({blue_points}\\*) {'-'.join(blue_alliance)}"
+            elif (prediction := match_prediction(match, predictions)) is not None:  # If predictions are available
+                red_alliance_text = f"{red_alliance} ({round(prediction['red']['score'])}\\*)"
+                blue_alliance_text = f"({round(prediction['blue']['score'])}\\*) {blue_alliance}"
 
                 if prediction["winning_alliance"] == "red":
                     red_alliance_text = f"*{red_alliance_text}*"
@@ -62,41 +111,12 @@ def format_matches(matches: list[MatchSimple], title: str, team_number: int = 0,
 
                 embed.set_footer(text="* Predicted Points")
             else:
-                red_alliance_text = "-".join(red_alliance)
-                blue_alliance_text = "-".join(blue_alliance)
+                red_alliance_text = red_alliance
+                blue_alliance_text = blue_alliance
 
             alliances_text = f"{red_alliance_text} vs {blue_alliance_text}"
 
-        if match["comp_level"] == "qm":
-            match_name = f"Qualification {match['match_number']}"
-        elif match["comp_level"] == "sf":
-            if match["set_number"] in [1, 2, 3, 4]:
-                match_name = f"Upper Quarterfinals"
-            elif match["set_number"] in [5, 6]:
-                match_name = f"Lower Round 1"
-            elif match["set_number"] in [7, 8]:
-                match_name = f"Upper Semifinals"
-            elif match["set_number"] in [9, 10]:
-                match_name = f"Lower Round 2"
-            elif match["set_number"] == 11:
-                match_name = f"Upper Finals"
-            elif match["set_number"] == 12:
-                match_name = f"Lower Round 3"
-            elif match["set_number"] == 13:
-                match_name = f"Lower Finals"
-            elif match["set_number"] == 14:
-                match_name = f"Finals"
-            else:
-                match_name = f"Playoff Match"
-
-            match_name += f" ({match['set_number']})"
-
-        elif match["comp_level"] == "f":
-            match_name = f"Finals {match['match_number']}"
-        else:
-            match_name = "Match"
-
-        embed.add_field(name=f"{match_name} | {time_text}",
+        embed.add_field(name=f"{match_name(match)} | {time_text}",
                         value=alliances_text, inline=False)
 
     return embed
@@ -125,12 +145,73 @@ def format_playoff_round(matches: list[MatchSimple], title: str) -> discord.Embe
     return embed
 
 
-async def get_current_event(team_number: int):
-    events = await tba_api.team_events_year(f"frc{team_number}", 2023)
-    for event in events:
-        current_date = datetime.now()
-        start_date = datetime.strptime(event["start_date"], "%Y-%m-%d")
-        end_date = datetime.strptime(event["end_date"], "%Y-%m-%d")
-        if start_date < current_date < end_date:
-            return event["event_code"]
-    return None
+def format_comparison(summaries: list[TeamSummary], title: str, total: int) -> discord.Embed:
+    """Formats team summaries as a table sorted by OPR, noting how many teams are still loading."""
+    summaries = sorted(summaries, key=lambda summary: (summary.opr is None, -(summary.opr or 0),
+                                                       int(summary.team_key[3:])))
+    lines = [f"{'Team':<6} {'W-L-T':<9} {'Avg':>5} {'OPR':>6} {'Best':>4} {'Evts':>4}"]
+    for summary in summaries:
+        if summary.error is not None:
+            lines.append(f"{summary.team_key[3:]:<6} {summary.error}")
+            continue
+        record = f"{summary.wins}-{summary.losses}-{summary.ties}"
+        average = f"{summary.average_score:.0f}" if summary.average_score is not None else "-"
+        opr = f"{summary.opr:.1f}" if summary.opr is not None else "-"
+        best_rank = str(summary.best_rank) if summary.best_rank is not None else "-"
+        lines.append(f"{summary.team_key[3:]:<6} {record:<9} {average:>5} {opr:>6} {best_rank:>4} {summary.events:>4}")
+
+    embed = discord.Embed(title=title, description="```\n" + "\n".join(lines) + "\n```")
+    if len(summaries) < total:
+        embed.set_footer(text=f"Loading... {len(summaries)}/{total} teams")
+    else:
+        event_keys = {summary.opr_event_key for summary in summaries if summary.opr is not None}
+        opr_source = f"OPR at {event_keys.pop()}" if len(event_keys) == 1 else "OPR at each team's latest event"
+        embed.set_footer(text=f"Avg: average alliance score. Best: best qualification rank. {opr_source}.")
+    return embed
+
+
+def channel_list(channel_ids: frozenset[int]) -> str:
+    return ", ".join(f"<#{channel_id}>" for channel_id in sorted(channel_ids))
+
+
+def format_stats(metrics: Metrics) -> discord.Embed:
+    """Summarizes TBA requests, cache lookups and command latency."""
+    embed = discord.Embed(title="Bot Statistics")
+
+    requests: dict[str, dict[str, float]] = {}
+    for labels, count in metrics.counters.get("tba_requests_total", {}).items():
+        label_dict = dict(labels)
+        requests.setdefault(label_dict["endpoint"], {})[label_dict["status"]] = count
+
+    request_lines = []
+    for endpoint, statuses in sorted(requests.items()):
+        histogram = metrics.histograms.get("tba_request_seconds", {}).get((("endpoint", endpoint),))
+        latency = ""
+        if histogram is not None and histogram.count > 0:
+            latency = (f", avg {histogram.sum / histogram.count * 1000:.0f} ms, "
+                       f"p95 ≤ {histogram.quantile(0.95) * 1000:.0f} ms")
+        status_counts = ", ".join(f"{status}: {count:.0f}" for status, count in sorted(statuses.items()))
+        request_lines.append(f"**{endpoint}**: {status_counts}{latency}")
+    embed.add_field(name="TBA Requests", value="\n".join(request_lines) or "None yet", inline=False)
+
+    results = {dict(labels)["result"]: count for labels, count in metrics.counters.get("tba_cache_total", {}).items()}
+    # Disk hits, revalidations and stale fallbacks are outcomes of misses, so they are not lookups themselves
+    served = results.get("hit", 0) + results.get("stale", 0)
+    lookups = served + results.get("miss", 0)
+    cache_lines = [f"{result}: {count:.0f}" for result, count in sorted(results.items())]
+    if lookups > 0:
+        cache_lines.append(f"Hit ratio: {served / lookups:.0%}")
+    embed.add_field(name="Cache", value="\n".join(cache_lines) or "None yet", inline=False)
+
+    command_lines = []
+    for labels, histogram in sorted(metrics.histograms.get("command_seconds", {}).items()):
+        command_labels = dict(labels)
+        errors = metrics.counter("command_errors_total", command_labels)
+        deferred = metrics.counter("command_deferred_total", command_labels)
+        command_lines.append(f"**{command_labels['command']}**: {histogram.count} run, "
+                             f"avg {histogram.sum / histogram.count * 1000:.0f} ms, "
+                             f"p95 ≤ {histogram.quantile(0.95) * 1000:.0f} ms, "
+                             f"{errors:.0f} errors, {deferred:.0f} deferred")
+    embed.add_field(name="Commands", value="\n".join(command_lines) or "None yet", inline=False)
+    return embed
+
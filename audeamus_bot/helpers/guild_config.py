@@ -0,0 +1,100 @@
+import json
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+from typing import Optional
+
+import aiosqlite
+
+from audeamus_bot.api.coordination import BUSY_TIMEOUT
+
+
+@dataclass(frozen=True)
+class GuildConfig:
+    """The settings of one Discord server.
+
+    Args:
+        team_number: the team used when a command is not given one
+        year: the season used when a command is not given one, or None for the current year
+        channels: the channels commands can be used in, or empty for every channel
+    """
+    team_number: Optional[int] = None
+    year: Optional[int] = None
+    channels: frozenset[int] = field(default_factory=frozenset)
+
+    @property
+    def season(self) -> int:
+        return self.year if self.year is not None else datetime.now().year
+
+
+class GuildConfigStore:
+    """Per-server settings kept in a local SQLite table.
+
+    Settings are read from the database once per server and then served from memory, so looking
+    them up for every interaction is cheap.
+
+    Args:
+        filename: the SQLite database file
+        default_team_number: the team used by servers that have not set one
+    """
+
+    def __init__(self, filename: str = "guild_config.sqlite", default_team_number: Optional[int] = None):
+        self.filename = filename
+        self.default = GuildConfig(default_team_number)
+        self.connection: Optional[aiosqlite.Connection] = None
+        self.configs: dict[int, GuildConfig] = {}
+
+    async def open(self):
+        # Processes running different shards share the file
+        self.connection = await aiosqlite.connect(self.filename, timeout=BUSY_TIMEOUT)
+        await self.connection.execute("PRAGMA journal_mode=WAL")
+        await self.connection.execute("CREATE TABLE IF NOT EXISTS guild_config ("
+                                      "guild_id INTEGER PRIMARY KEY, team_number INTEGER, year INTEGER, "
+                                      "channels TEXT NOT NULL DEFAULT '[]')")
+        await self.connection.commit()
+
+    async def close(self):
+        if self.connection is not None:
+            await self.connection.close()
+            self.connection = None
+
+    async def get(self, guild_id: int) -> GuildConfig:
+        config = self.configs.get(guild_id)
+        if config is not None:
+            return config
+
+        async with self.connection.execute("SELECT team_number, year, channels FROM guild_config WHERE guild_id = ?",
+                                           (guild_id,)) as cursor:  # type: ignore
+            row = await cursor.fetchone()
+
+        if row is None:
+            config = self.default
+        else:
+            team_number, year, channels = row
+            config = GuildConfig(team_number if team_number is not None else self.default.team_number,
+                                 year, frozenset(json.loads(channels)))
+        self.configs[guild_id] = config
+        return config
+
+    async def update(self, guild_id: int, **changes) -> GuildConfig:
+        """Changes some of a server's settings and saves them.
+
+        Args:
+            guild_id: the server
+            **changes: the GuildConfig fields to change
+        """
+        config = replace(await self.get(guild_id), **changes)
+        await self.connection.execute(  # type: ignore
+            "INSERT OR REPLACE INTO guild_config (guild_id, team_number, year, channels) VALUES (?, ?, ?, ?)",
+            (guild_id, config.team_number, config.year, json.dumps(sorted(config.channels))))
+        await self.connection.commit()  # type: ignore
+        self.configs[guild_id] = config
+        return config
+
+    async def team_numbers(self) -> set[int]:
+        """Gets every team followed by a server, including the default team."""
+        async with self.connection.execute("SELECT DISTINCT team_number FROM guild_config "
+                                           "WHERE team_number IS NOT NULL") as cursor:  # type: ignore
+            team_numbers = {team_number for team_number, in await cursor.fetchall()}
+        if self.default.team_number is not None:
+            team_numbers.add(self.default.team_number)
+        return team_numbers
@@ -1,23 +1,95 @@
-from typing import Callable
+import asyncio
+from collections import OrderedDict
+from typing import Callable, Optional
 
 import discord
 
 
 class Page(discord.ui.View):
+    """Buttons to flip through the pages of a paginated embed.
+
+    Pages are rendered at most once per view, and the next page is rendered in the background after
+    each flip. Only ``max_live_views`` views are kept listening at once; when there are more, the
+    oldest one is closed early and its buttons are disabled.
+
+    Args:
+        start_page: the page shown first
+        num_pages: the number of pages
+        formatter: renders the embed for a page
+        timeout: seconds without a button press before the buttons are disabled
+        prerender: whether to render the next page in the background
+    """
+
+    max_live_views = 100
+
+    # The views still listening for button presses, oldest first
+    live_views: OrderedDict["Page", None] = OrderedDict()
+
+    # Views being closed, kept so the tasks are not garbage collected
+    _closing: set[asyncio.Task] = set()
+
     def __init__(self, start_page: int, num_pages: int,
-                 formatter: Callable[[int], discord.Embed]):
-        super().__init__()
+                 formatter: Callable[[int], discord.Embed], timeout: Optional[float] = 300,
+                 prerender: bool = True):
+        super().__init__(timeout=timeout)
 
         self.page = start_page
         self.num_pages = num_pages
-        self.formatter = formatter
+        self.formatter: Optional[Callable[[int], discord.Embed]] = formatter
+        self.prerender = prerender
+        self.rendered: dict[int, discord.Embed] = {}
+
+        # The interaction that sent the message, set once it has been sent, used to disable the buttons
+        self.interaction: Optional[discord.Interaction] = None
+
+        Page.live_views[self] = None
+        while len(Page.live_views) > Page.max_live_views:
+            oldest, _ = Page.live_views.popitem(last=False)
+            task = asyncio.create_task(oldest.close())
+            Page._closing.add(task)
+            task.add_done_callback(Page._closing.discard)
+
+    def render(self, page: int) -> discord.Embed:
+        """Gets the embed for the page, rendering it if it has not been rendered before."""
+        embed = self.rendered.get(page)
+        if embed is None and self.formatter is not None:
+            embed = self.rendered[page] = self.formatter(page)
+        return embed  # type: ignore
+
+    def show(self, page: int) -> discord.Embed:
+        """Moves to the page and gets its embed, rendering the following page in the background."""
+        self.page = page % self.num_pages
+        embed = self.render(self.page)
+
+        next_page = (self.page + 1) % self.num_pages
+        if self.prerender and next_page not in self.rendered:
+            asyncio.get_running_loop().call_soon(self.render, next_page)
+        return embed
+
+    async def close(self):
+        """Stops listening for button presses, disables the buttons and frees the rendered pages."""
+        Page.live_views.pop(self, None)
+        self.stop()
+        self.rendered.clear()
+        self.formatter = None
+
+        for item in self.children:
+            item.disabled = True  # type: ignore
+
+        if self.interaction is not None:
+            try:
+                await self.interaction.edit_original_response(view=self)
+            except discord.HTTPException:
+                pass
+            self.interaction = None
+
+    async def on_timeout(self):
+        await self.close()
 
     @discord.ui.button(label="\N{Black Left-Pointing Triangle}", style=discord.ButtonStyle.gray)
     async def prev_page(self, interaction: discord.Interaction, button: discord.ui.Button):
-        self.page = (self.page - 1) % self.num_pages
-        await interaction.response.edit_message(embed=self.formatter(self.page))
+        await interaction.response.edit_message(embed=self.show(self.page - 1))
 
     @discord.ui.button(label="\N{Black Right-Pointing Triangle}", style=discord.ButtonStyle.gray)
     async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
-        self.page = (self.page + 1) % self.num_pages
-        await interaction.response.edit_message(embed=self.formatter(self.page))
+        await interaction.response.edit_message(embed=self.show(self.page + 1))
@@ -0,0 +1,106 @@
+import asyncio
+import time
+import traceback
+from typing import Optional
+
+from audeamus_bot.api.tba_api import TBAClient
+from audeamus_bot.helpers.event_calendar import EventCalendar
+from audeamus_bot.types.match_table import MatchTable
+from audeamus_bot.types.tba_types import MatchSimple
+
+
+class Prefetcher:
+    """Keeps the TBA data for a team's active event warm in the cache.
+
+    While the team is at an event, its matches and the event's matches, predictions, rankings and OPRs are
+    refreshed in the background so that commands are answered from the cache. Refreshes happen
+    more often around scheduled matches and rarely when the team is not competing.
+
+    Args:
+        tba: the TBA client to refresh through
+        team_number: the team whose active event to follow
+        calendar: the index used to find the team's active event
+        match_interval: seconds between refreshes when a match is within ``match_window``
+        event_interval: seconds between refreshes during the rest of an event day
+        idle_interval: seconds between checks when there are no matches coming up
+        match_window: seconds before and after a scheduled match that count as match time
+        day_window: seconds ahead to look for another match before going idle (e.g. overnight)
+    """
+
+    def __init__(self, tba: TBAClient, team_number: int, calendar: EventCalendar, match_interval: float = 60,
+                 event_interval: float = 300, idle_interval: float = 3600,
+                 match_window: float = 30 * 60, day_window: float = 3 * 60 * 60):
+        self.tba = tba
+        self.team_number = team_number
+        self.calendar = calendar
+        self.match_interval = match_interval
+        self.event_interval = event_interval
+        self.idle_interval = idle_interval
+        self.match_window = match_window
+        self.day_window = day_window
+
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self):
+        while True:
+            try:
+                delay = await self.refresh()
+            except Exception:
+                traceback.print_exc()
+                delay = self.event_interval
+            await asyncio.sleep(delay)
+
+    async def refresh(self) -> float:
+        """Refreshes the active event's endpoints.
+
+        Returns:
+            The number of seconds to wait before the next refresh
+        """
+        event_key = await self.calendar.current_event(f"frc{self.team_number}")
+        if event_key is None:
+            return self.idle_interval
+
+        year = int(event_key[:4])
+        matches, *_ = await asyncio.gather(self.tba.team_matches_year_simple(f"frc{self.team_number}", year),
+                                           self.tba.event_predictions(event_key),
+                                           self.tba.event_matches_simple(event_key),
+                                           self.tba.event_rankings(event_key),
+                                           self.tba.event_oprs(event_key),
+                                           return_exceptions=True)
+        if isinstance(matches, BaseException):
+            return self.event_interval
+
+        if isinstance(matches, MatchTable):
+            return self.next_interval(list(matches.take(matches.event_indices(event_key))))
+        return self.next_interval([match for match in matches if match["event_key"] == event_key])
+
+    def next_interval(self, matches: list[MatchSimple]) -> float:
+        # The schedule has not been released yet
+        if len(matches) == 0:
+            return self.event_interval
+
+        now = time.time()
+        match_times = [match["predicted_time"] or match["time"] for match in matches
+                       if match["actual_time"] is None]
+
+        if any(match_time is not None and abs(match_time - now) <= self.match_window
+               for match_time in match_times):
+            return self.match_interval
+        elif any(match_time is not None and now < match_time <= now + self.day_window
+                 for match_time in match_times):
+            return self.event_interval
+        else:
+            return self.idle_interval
@@ -0,0 +1,140 @@
+import bisect
+from collections import defaultdict
+from typing import Callable, Iterable, Optional
+
+from aiohttp import web
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+Labels = tuple[tuple[str, str], ...]
+
+# Yields (name, type, help, labels, value) samples computed when the metrics are rendered
+Collector = Callable[[], Iterable[tuple[str, str, str, dict[str, str], float]]]
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, fraction: float) -> float:
+        """Estimates a quantile as the upper bound of the bucket it falls in."""
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """Counters and latency histograms for TBA requests and commands, rendered in the Prometheus text format.
+
+    Metrics are created on first use; ``describe`` sets their help text.
+    """
+
+    def __init__(self):
+        self.counters: dict[str, dict[Labels, float]] = defaultdict(lambda: defaultdict(float))
+        self.histograms: dict[str, dict[Labels, Histogram]] = defaultdict(dict)
+        self.help: dict[str, str] = {}
+        self.collectors: list[Collector] = []
+        self.runner: Optional[web.AppRunner] = None
+
+        self.describe("tba_requests_total", "TBA API responses by endpoint and status")
+        self.describe("tba_request_seconds", "Latency of TBA API requests by endpoint")
+        self.describe("tba_cache_total", "TBA cache lookups by result")
+        self.describe("tba_invalidations_total", "TBA cache entries invalidated, by endpoint")
+        self.describe("tba_validation_errors_total", "TBA responses that did not match their types, by endpoint")
+        self.describe("tba_budget_wait_seconds", "Time requests waited for the request budget shared between processes")
+        self.describe("command_seconds", "Time from a command being received to it being answered")
+        self.describe("command_errors_total", "Commands that raised an error")
+        self.describe("command_deferred_total", "Commands that were deferred because they were not ready in time")
+
+    def describe(self, name: str, help_text: str):
+        self.help[name] = help_text
+
+    def inc(self, name: str, labels: Optional[dict[str, str]] = None, value: float = 1):
+        self.counters[name][_labels(labels)] += value
+
+    def observe(self, name: str, value: float, labels: Optional[dict[str, str]] = None):
+        histograms = self.histograms[name]
+        key = _labels(labels)
+        if key not in histograms:
+            histograms[key] = Histogram()
+        histograms[key].observe(value)
+
+    def counter(self, name: str, labels: Optional[dict[str, str]] = None) -> float:
+        return self.counters.get(name, {}).get(_labels(labels), 0)
+
+    def add_collector(self, collector: Collector):
+        """Adds a function providing samples of values tracked elsewhere, e.g. cache sizes."""
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        """Renders all metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, samples in self.counters.items():
+            lines += _header(name, "counter", self.help.get(name))
+            lines += [f"{name}{_format_labels(labels)} {value}" for labels, value in samples.items()]
+
+        for name, histograms in self.histograms.items():
+            lines += _header(name, "histogram", self.help.get(name))
+            for labels, histogram in histograms.items():
+                cumulative = 0
+                for bound, count in zip((*histogram.buckets, "+Inf"), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels((*labels, ('le', str(bound))))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+
+        described = set()
+        for collector in self.collectors:
+            for name, metric_type, help_text, labels, value in collector():
+                if name not in described:
+                    lines += _header(name, metric_type, help_text)
+                    described.add(name)
+                lines.append(f"{name}{_format_labels(_labels(labels))} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    async def start_server(self, host: str = "127.0.0.1", port: int = 9100):
+        """Serves the metrics at ``/metrics`` for Prometheus to scrape."""
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+
+    async def stop_server(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+def _labels(labels: Optional[dict[str, str]]) -> Labels:
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _format_labels(labels: Labels) -> str:
+    if len(labels) == 0:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+def _header(name: str, metric_type: str, help_text: Optional[str]) -> list[str]:
+    lines = [f"# HELP {name} {help_text}"] if help_text else []
+    return lines + [f"# TYPE {name} {metric_type}"]
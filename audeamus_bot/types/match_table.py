@@ -0,0 +1,183 @@
+import copy
+import sys
+from array import array
+from collections.abc import Iterable, Iterator, Sequence
+from typing import Optional, Union, overload
+
+from audeamus_bot.types.tba_types import MatchSimple
+
+COMP_LEVELS = ("qm", "ef", "qf", "sf", "f")
+
+WINNING_ALLIANCES = (None, "", "red", "blue")
+
+# Stands in for None in the integer columns
+MISSING = -(2 ** 63)
+
+TIME_COLUMNS = ("time", "predicted_time", "actual_time")
+
+
+class MatchTable:
+    """A compact, column-oriented store of simple matches.
+
+    Each field is kept in an ``array`` instead of a dict per match: comp levels and winners as small
+    codes, scores and times as integers with ``MISSING`` for None, and teams as indices into a list of
+    interned team keys (so ``frc1234B`` works too). Surrogate and DQ teams are not kept.
+
+    Slices and ``take`` return views that share the columns. Iterating or indexing yields ``MatchSimple``
+    dicts, so code written for lists of matches still works, e.g. formatting a page.
+
+    Use ``MatchTable.from_matches`` to build one from the JSON form.
+    """
+
+    __slots__ = ("keys", "event_keys", "event_codes", "comp_levels", "set_numbers", "match_numbers",
+                 "team_keys", "alliance_size", "red_teams", "blue_teams", "red_scores", "blue_scores",
+                 "has_alliances", "winning_alliances", "time", "predicted_time", "actual_time",
+                 "rows")
+
+    def __init__(self, event_keys: list[str], team_keys: list[str], alliance_size: int):
+        self.keys: list[str] = []
+        self.event_keys = event_keys
+        self.event_codes = array("H")
+        self.comp_levels = array("b")
+        self.set_numbers = array("H")
+        self.match_numbers = array("H")
+
+        # Teams are stored as one more than their index in team_keys, with 0 for an empty slot
+        self.team_keys = team_keys
+        self.alliance_size = alliance_size
+        self.red_teams = array("H")
+        self.blue_teams = array("H")
+        self.red_scores = array("q")
+        self.blue_scores = array("q")
+        self.has_alliances = array("b")
+        self.winning_alliances = array("b")
+
+        self.time = array("q")
+        self.predicted_time = array("q")
+        self.actual_time = array("q")
+
+        # The rows of the columns in this view, in order, or None for all of them
+        self.rows: Optional[list[int]] = None
+
+    @classmethod
+    def from_matches(cls, matches: Iterable[MatchSimple]) -> "MatchTable":
+        matches = list(matches)
+        alliance_size = max((len(alliance["team_keys"]) for match in matches if match["alliances"] is not None
+                             for alliance in match["alliances"].values()), default=3)
+        table = cls([], [], alliance_size)
+        event_codes: dict[str, int] = {}
+        team_codes: dict[str, int] = {}
+
+        def team_code(team_key: str) -> int:
+            code = team_codes.get(team_key)
+            if code is None:
+                table.team_keys.append(sys.intern(team_key))
+                code = team_codes[team_key] = len(table.team_keys)
+            return code
+
+        empty_alliance = [0] * alliance_size
+        for match in matches:
+            table.keys.append(sys.intern(match["key"]))
+
+            event_code = event_codes.get(match["event_key"])
+            if event_code is None:
+                table.event_keys.append(sys.intern(match["event_key"]))
+                event_code = event_codes[match["event_key"]] = len(table.event_keys) - 1
+            table.event_codes.append(event_code)
+
+            table.comp_levels.append(COMP_LEVELS.index(match["comp_level"]))
+            table.set_numbers.append(match["set_number"])
+            table.match_numbers.append(match["match_number"])
+
+            alliances = match["alliances"]
+            table.has_alliances.append(alliances is not None)
+            for color, teams, scores in (("red", table.red_teams, table.red_scores),
+                                         ("blue", table.blue_teams, table.blue_scores)):
+                if alliances is None:
+                    teams.extend(empty_alliance)
+                    scores.append(MISSING)
+                    continue
+                alliance = alliances[color]  # type: ignore
+                codes = [team_code(team_key) for team_key in alliance["team_keys"]]
+                teams.extend(codes + [0] * (alliance_size - len(codes)))
+                scores.append(MISSING if alliance["score"] is None else alliance["score"])
+
+            table.winning_alliances.append(WINNING_ALLIANCES.index(match["winning_alliance"]))
+            for column in TIME_COLUMNS:
+                value = match[column]  # type: ignore
+                getattr(table, column).append(MISSING if value is None else value)
+
+        return table
+
+    def __len__(self) -> int:
+        return len(self.keys) if self.rows is None else len(self.rows)
+
+    @overload
+    def __getitem__(self, index: int) -> MatchSimple: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> "MatchTable": ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[MatchSimple, "MatchTable"]:
+        if isinstance(index, slice):
+            return self.take(range(len(self))[index])
+        return self.match(range(len(self))[index])
+
+    def __iter__(self) -> Iterator[MatchSimple]:
+        return (self.match(i) for i in range(len(self)))
+
+    def row(self, i: int) -> int:
+        """Gets the row of the columns for an index into this view."""
+        return i if self.rows is None else self.rows[i]
+
+    def all_rows(self) -> Sequence[int]:
+        return range(len(self.keys)) if self.rows is None else self.rows
+
+    def alliance_team_keys(self, teams: array, row: int) -> list[str]:
+        start = row * self.alliance_size
+        return [self.team_keys[code - 1] for code in teams[start:start + self.alliance_size] if code != 0]
+
+    def match(self, i: int) -> MatchSimple:
+        """Builds the ``MatchSimple`` dict for an index into this view."""
+        row = self.row(i)
+        if self.has_alliances[row]:
+            alliances = {color: {"score": None if scores[row] == MISSING else scores[row],
+                                 "team_keys": self.alliance_team_keys(teams, row),
+                                 "surrogate_team_keys": None, "dq_team_keys": None}
+                         for color, teams, scores in (("red", self.red_teams, self.red_scores),
+                                                      ("blue", self.blue_teams, self.blue_scores))}
+        else:
+            alliances = None
+
+        times = {column: None if (value := getattr(self, column)[row]) == MISSING else value
+                 for column in TIME_COLUMNS}
+        return {"key": self.keys[row], "comp_level": COMP_LEVELS[self.comp_levels[row]],  # type: ignore
+                "set_number": self.set_numbers[row], "match_number": self.match_numbers[row],
+                "alliances": alliances, "winning_alliance": WINNING_ALLIANCES[self.winning_alliances[row]],
+                "event_key": self.event_keys[self.event_codes[row]], **times}
+
+    def _view(self, rows: list[int]) -> "MatchTable":
+        view = copy.copy(self)
+        view.rows = rows
+        return view
+
+    def take(self, indices: Iterable[int]) -> "MatchTable":
+        """Gets a view of the matches at the indices into this view, in that order."""
+        return self._view([self.row(i) for i in indices])
+
+    def event_indices(self, event_key: str) -> list[int]:
+        if event_key not in self.event_keys:
+            return []
+        code = self.event_keys.index(event_key)
+        return [i for i, row in enumerate(self.all_rows()) if self.event_codes[row] == code]
+
+    @property
+    def nbytes(self) -> int:
+        """Estimates the memory used by the columns, not counting the shared key strings."""
+        arrays = (getattr(self, column) for column in self.__slots__
+                  if isinstance(getattr(self, column), array))
+        return sum(values.itemsize * len(values) for values in arrays) + sys.getsizeof(self.keys)
+
+
+# Responses for a list of matches, decoded either as dicts or into a MatchTable
+Matches = Union[list[MatchSimple], MatchTable]
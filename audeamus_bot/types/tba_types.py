@@ -1,4 +1,4 @@
-from typing import Literal, Optional, TypedDict
+from typing import Literal, NotRequired, Optional, TypedDict
 
 
 class DistrictList(TypedDict):
@@ -34,8 +34,8 @@ class Event(TypedDict):
     postal_code: Optional[str]
     gmaps_place_id: Optional[str]
     gmaps_url: Optional[str]
-    lat: Optional[int]
-    lng: Optional[int]
+    lat: Optional[float]
+    lng: Optional[float]
     location_name: Optional[str]
     timezone: Optional[str]
     website: Optional[str]
@@ -48,7 +48,7 @@ class Event(TypedDict):
     playoff_type_string: Optional[str]
 
 
-# Prediction Types: may change at any time
+# Prediction Types: TBA adds fields for each season's game, so only the fields every season has are typed
 
 
 class BrierScores(TypedDict):
@@ -69,14 +69,8 @@ class MatchPredictionStats(TypedDict):
 
 
 class SingleMatchTeamPrediction(TypedDict):
-    charge_station_points: float
-    charge_station_points_var: float
-    links: float
-    links_var: float
-    prob_activation_bonus: float
-    prob_sustainability_bonus: float
     score: float
-    score_var: float
+    score_var: NotRequired[float]
 
 
 class SingleMatchPrediction(TypedDict):
@@ -108,10 +102,8 @@ class TaskPointsMeanVars(TypedDict):
     var: TeamTaskPointsStats
 
 
-class MatchTypeStatMeanVars(TypedDict):
-    charge_station_points: TaskPointsMeanVars
-    links: TaskPointsMeanVars
-    score: TaskPointsMeanVars
+# Keyed by stat, e.g. "score" and the season's game-specific stats
+MatchTypeStatMeanVars = dict[str, TaskPointsMeanVars]
 
 
 class StatMeanVars(TypedDict):
@@ -0,0 +1,113 @@
+import bisect
+from collections.abc import Sequence
+from typing import Optional
+
+from audeamus_bot.types.lru_cache import LRUCache
+from audeamus_bot.types.match_table import MISSING, Matches, MatchTable
+from audeamus_bot.types.tba_types import MatchSimple
+
+def match_time(match: MatchSimple) -> Optional[int]:
+    """Gets when a match was played, or else when it is predicted or scheduled to be played."""
+    for column in ("actual_time", "predicted_time", "time"):
+        if match[column] is not None:  # type: ignore
+            return match[column]  # type: ignore
+    return None
+
+
+def _match_times(matches: Matches) -> dict[str, Optional[int]]:
+    """Gets the time of each match by key, reading the columns directly for a MatchTable."""
+    if not isinstance(matches, MatchTable):
+        return {match["key"]: match_time(match) for match in matches}
+
+    times = {}
+    for row in matches.all_rows():
+        value = MISSING
+        for column in (matches.actual_time, matches.predicted_time, matches.time):
+            if column[row] != MISSING:
+                value = column[row]
+                break
+        times[matches.keys[row]] = None if value == MISSING else value
+    return times
+
+
+class TeamTimeline:
+    """A team's matches in a season, kept sorted by when they are played.
+
+    Each match is placed at its ``actual_time`` once played, otherwise at its ``predicted_time``, or
+    its scheduled ``time`` when TBA has no prediction. Matches without any time are left out. Upcoming
+    and previous matches are found by binary search rather than filtering and sorting every match.
+
+    ``update`` takes the latest response for the team's matches and only moves the matches whose times
+    changed.
+    """
+
+    def __init__(self):
+        # (time, match key) of each match, sorted
+        self.entries: list[tuple[int, str]] = []
+        self.times: dict[str, Optional[int]] = {}
+
+        # The response the timeline was last updated from, and the index of each match in it
+        self.source: Optional[Matches] = None
+        self.indices: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def update(self, matches: Matches) -> bool:
+        """Brings the timeline up to date with a response for the team's matches.
+
+        Returns:
+            Whether the response was different from the last one
+        """
+        if matches is self.source:
+            return False
+
+        times = _match_times(matches)
+        for key, old_time in self.times.items():
+            if old_time is not None and (key not in times or times[key] != old_time):
+                del self.entries[bisect.bisect_left(self.entries, (old_time, key))]
+        for key, new_time in times.items():
+            if new_time is not None and self.times.get(key) != new_time:
+                bisect.insort(self.entries, (new_time, key))
+
+        self.times = times
+        self.source = matches
+        self.indices = {key: i for i, key in enumerate(times)}
+        return True
+
+    def _select(self, entries: Sequence[tuple[int, str]]) -> Matches:
+        indices = [self.indices[key] for _, key in entries]
+        if isinstance(self.source, MatchTable):
+            return self.source.take(indices)
+        return [self.source[i] for i in indices]  # type: ignore
+
+    def upcoming(self, now: float) -> Matches:
+        """Gets the matches after the time, soonest first."""
+        start = bisect.bisect_right(self.entries, now, key=lambda entry: entry[0])
+        return self._select(self.entries[start:])
+
+    def previous(self, now: float) -> Matches:
+        """Gets the matches before the time, latest first."""
+        end = bisect.bisect_left(self.entries, now, key=lambda entry: entry[0])
+        return self._select(self.entries[end - 1::-1] if end > 0 else [])
+
+
+class TeamTimelines:
+    """The timelines of the teams most recently looked up, by team key and year.
+
+    Args:
+        max_entries: the maximum number of timelines to keep
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self._timelines: LRUCache[tuple[str, int], TeamTimeline] = LRUCache(max_entries)
+
+    def get(self, team_key: str, year: int, matches: Matches) -> TeamTimeline:
+        """Gets the team's timeline for the year, updated with the latest response for its matches."""
+        timeline = self._timelines.get((team_key, year))
+        if timeline is None:
+            timeline = TeamTimeline()
+            self._timelines.put((team_key, year), timeline)
+
+        timeline.update(matches)
+        return timeline
@@ -0,0 +1,180 @@
+"""Micro-benchmark of format.format_matches on a synthetic full-season match list.
+
+Compares the table-driven formatter against the original per-match implementation,
+which is kept below as the reference, and checks that both produce the same embeds.
+
+Usage: python -m benchmarks.bench_format [number of events] [repeats]
+"""
+import random
+import sys
+import timeit
+from datetime import datetime
+from typing import Optional
+
+import discord
+
+from audeamus_bot.helpers import format
+from audeamus_bot.types.tba_types import MatchPredictions, MatchSimple
+
+MATCHES_PER_PAGE = 8
+
+
+def synthetic_season(num_events: int, teams_per_event: int = 40, quals_per_event: int = 80,
+                     seed: int = 0) -> tuple[list[MatchSimple], MatchPredictions]:
+    """Generates every match of a season of events, half of them played, with predictions for the rest."""
+    rng = random.Random(seed)
+    matches: list[MatchSimple] = []
+    predictions: MatchPredictions = {"qual": {}, "playoff": {}}
+    start_time = 1_680_000_000
+
+    for event in range(num_events):
+        event_key = f"2023ev{event}"
+        teams = [f"frc{number}" for number in rng.sample(range(1, 9999), teams_per_event)]
+        levels = ([("qm", 1, number) for number in range(1, quals_per_event + 1)]
+                  + [("sf", number, 1) for number in range(1, 15)]
+                  + [("f", 1, number) for number in range(1, 4)])
+
+        for i, (comp_level, set_number, match_number) in enumerate(levels):
+            key = f"{event_key}_{comp_level}{set_number}m{match_number}"
+            played = i < len(levels) // 2
+            alliance_teams = rng.sample(teams, 6)
+            red_score = rng.randint(20, 150) if played else -1
+            blue_score = rng.randint(20, 150) if played else -1
+            matches.append({
+                "key": key, "comp_level": comp_level, "set_number": set_number, "match_number": match_number,
+                "alliances": {"red": {"score": red_score, "team_keys": alliance_teams[:3],
+                                      "surrogate_team_keys": [], "dq_team_keys": []},
+                              "blue": {"score": blue_score, "team_keys": alliance_teams[3:],
+                                       "surrogate_team_keys": [], "dq_team_keys": []}},
+                "winning_alliance": ("red" if red_score > blue_score else "blue") if played else "",
+                "event_key": event_key, "time": None,
+                "predicted_time": start_time + event * 7 * 86400 + i * 420,
+                "actual_time": None,
+            })
+            if not played:
+                red, blue = rng.uniform(20, 150), rng.uniform(20, 150)
+                predictions["qual" if comp_level == "qm" else "playoff"][key] = {
+                    "red": {"score": red}, "blue": {"score": blue}, "prob": 0.5,
+                    "winning_alliance": "red" if red > blue else "blue"}  # type: ignore
+
+    return matches, predictions
+
+
+def format_matches_reference(matches: list[MatchSimple], title: str, team_number: int = 0,
+                             predictions: Optional[MatchPredictions] = None) -> discord.Embed:
+    embed = discord.Embed(title=title)
+    last_event_key = ""
+
+    for match in matches:
+        if match["event_key"] != last_event_key:
+            embed.add_field(name=f"__**{match['event_key']}**__", value="")
+            last_event_key = match['event_key']
+
+        if match["predicted_time"] is None:
+            time_text = ""
+        else:
+            time_text = datetime.fromtimestamp(
+                match["predicted_time"]).strftime("%a %I:%M %p")
+
+        if match["alliances"] is None:
+            alliances_text = ""
+        else:
+            red_alliance = [(team_key[3:] if str(team_number) != team_key[3:]
+                             else f"__{team_key[3:]}__")
+                            for team_key in match["alliances"]["red"]["team_keys"]]
+            blue_alliance = [(team_key[3:] if str(team_number) != team_key[3:]
+                              else f"__{team_key[3:]}__")
+                             for team_key in match["alliances"]["blue"]["team_keys"]]
+
+            # If the match score has been updated
+            if match["alliances"]["red"]["score"] != -1:
+                red_points = match["alliances"]["red"]["score"]
+                blue_points = match["alliances"]["blue"]["score"]
+                red_alliance_text = f"{'-'.join(red_alliance)} ({red_points})"
+                blue_alliance_text = f"({blue_points}) {'-'.join(blue_alliance)}"
+                if match["winning_alliance"] == "red":
+                    red_alliance_text = f"**{red_alliance_text}**"
+                elif match["winning_alliance"] == "blue":
+                    blue_alliance_text = f"**{blue_alliance_text}**"
+            elif predictions is not None:  # If predictions are available
+                if match["comp_level"] == "qm":
+                    prediction = predictions["qual"][match["key"]]
+                else:
+                    prediction = predictions["playoff"][match["key"]]
+
+                red_points = round(prediction["red"]["score"])
+                blue_points = round(prediction["blue"]["score"])
+
+                red_alliance_text = f"{'-'.join(red_alliance)} ({red_points}\\*)"
+                blue_alliance_text = f"({blue_points}\\*) {'-'.join(blue_alliance)}"
+
+                if prediction["winning_alliance"] == "red":
+                    red_alliance_text = f"*{red_alliance_text}*"
+                elif prediction["winning_alliance"] == "blue":
+                    blue_alliance_text = f"*{blue_alliance_text}*"
+
+                embed.set_footer(text="* Predicted Points")
+            else:
+                red_alliance_text = "-".join(red_alliance)
+                blue_alliance_text = "-".join(blue_alliance)
+
+            alliances_text = f"{red_alliance_text} vs {blue_alliance_text}"
+
+        if match["comp_level"] == "qm":
+            match_name = f"Qualification {match['match_number']}"
+        elif match["comp_level"] == "sf":
+            if match["set_number"] in [1, 2, 3, 4]:
+                match_name = f"Upper Quarterfinals"
+            elif match["set_number"] in [5, 6]:
+                match_name = f"Lower Round 1"
+            elif match["set_number"] in [7, 8]:
+                match_name = f"Upper Semifinals"
+            elif match["set_number"] in [9, 10]:
+                match_name = f"Lower Round 2"
+            elif match["set_number"] == 11:
+                match_name = f"Upper Finals"
+            elif match["set_number"] == 12:
+                match_name = f"Lower Round 3"
+            elif match["set_number"] == 13:
+                match_name = f"Lower Finals"
+            elif match["set_number"] == 14:
+                match_name = f"Finals"
+            else:
+                match_name = f"Playoff Match"
+
+            match_name += f" ({match['set_number']})"
+
+        elif match["comp_level"] == "f":
+            match_name = f"Finals {match['match_number']}"
+        else:
+            match_name = "Match"
+
+        embed.add_field(name=f"{match_name} | {time_text}",
+                        value=alliances_text, inline=False)
+
+    return embed
+
+
+def format_pages(formatter, matches: list[MatchSimple], predictions: MatchPredictions) -> list[discord.Embed]:
+    return [formatter(matches[start:start + MATCHES_PER_PAGE], "Matches", 254, predictions)
+            for start in range(0, len(matches), MATCHES_PER_PAGE)]
+
+
+def main(num_events: int = 12, repeats: int = 20):
+    matches, predictions = synthetic_season(num_events)
+    print(f"{len(matches)} matches, {len(matches) // MATCHES_PER_PAGE + 1} pages")
+
+    reference = [embed.to_dict() for embed in format_pages(format_matches_reference, matches, predictions)]
+    current = [embed.to_dict() for embed in format_pages(format.format_matches, matches, predictions)]
+    assert reference == current, "format_matches output differs from the reference"
+
+    results = {}
+    for name, formatter in (("reference", format_matches_reference), ("format_matches", format.format_matches)):
+        seconds = min(timeit.repeat(lambda: format_pages(formatter, matches, predictions), number=1, repeat=repeats))
+        results[name] = seconds
+        print(f"{name:>16}: {seconds * 1000:.2f} ms")
+    print(f"speedup: {results['reference'] / results['format_matches']:.2f}x")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:3]))
@@ -0,0 +1,115 @@
+"""Benchmark of MatchTable against lists of MatchSimple dicts.
+
+Measures the memory a synthetic season takes in each form, the time to find a team's upcoming and
+previous matches with a TeamTimeline over the table, as the schedule and history commands do, against
+filtering and sorting the dicts, and the time to build a table from JSON. Checks that both ways select
+the same matches and format the same first page, and that a match list refreshed by a webhook is still
+cached as a table.
+
+Usage: python -m benchmarks.bench_match_table [number of events] [repeats]
+"""
+import asyncio
+import json
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable
+
+from audeamus_bot.api.tba_api import TBAClient
+from audeamus_bot.api.webhooks import WebhookReceiver
+from audeamus_bot.helpers import format
+from audeamus_bot.types.match_table import MatchTable
+from audeamus_bot.types.team_timeline import TeamTimeline
+from benchmarks.bench_format import MATCHES_PER_PAGE, synthetic_season
+from benchmarks.tba_standin import TBAStandIn
+
+
+def allocated(build: Callable[[], Any]) -> tuple[Any, int]:
+    """Builds an object and gets the number of bytes allocated for it."""
+    tracemalloc.start()
+    obj = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, size
+
+
+def upcoming_dicts(matches: list, now: int) -> list:
+    return sorted(filter(lambda match: match["predicted_time"] is not None and now < match["predicted_time"],
+                         matches),
+                  key=lambda match: match["predicted_time"])
+
+
+def previous_dicts(matches: list, now: int) -> list:
+    return sorted(filter(lambda match: match["predicted_time"] is not None and match["predicted_time"] < now,
+                         matches),
+                  key=lambda match: match["predicted_time"], reverse=True)
+
+
+async def check_webhook_refresh(season: list):
+    """Checks that a schedule notification refreshes an event's matches into a table in compact mode."""
+    event_key = season[0]["event_key"]
+    standin = TBAStandIn()
+    standin.set_fixture(f"/event/{event_key}/matches/simple", season[:100])
+    standin.set_fixture(f"/event/{event_key}/predictions", None)
+    base_url = await standin.start(port=0)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        tba = TBAClient(api_key="bench", base_url=base_url, cache_name=str(Path(cache_dir, "api_cache")),
+                        compact_matches=True)
+        try:
+            assert isinstance(await tba.event_matches_simple(event_key), MatchTable)
+            standin.set_fixture(f"/event/{event_key}/matches/simple", season[:101])
+            await WebhookReceiver(tba, "secret").update_cache("schedule_updated", {"event_key": event_key})
+            matches = await tba.event_matches_simple(event_key)
+            assert isinstance(matches, MatchTable) and len(matches) == 101
+        finally:
+            await tba.close()
+            await standin.stop()
+
+
+def main(num_events: int = 60, repeats: int = 20):
+    season, _ = synthetic_season(num_events)
+    body = json.dumps(season)
+    now = season[len(season) // 2]["predicted_time"]
+    print(f"{len(season)} matches")
+
+    # Measure each form as it would be held after decoding a response
+    dicts, dicts_size = allocated(lambda: json.loads(body))
+    table, table_size = allocated(lambda: MatchTable.from_matches(json.loads(body)))
+    print(f"{'memory':>16}: dicts {dicts_size / 1024:.0f} KiB, table {table_size / 1024:.0f} KiB "
+          f"({dicts_size / table_size:.1f}x smaller)")
+
+    timeline = TeamTimeline()
+    timeline.update(table)
+    upcoming_table = timeline.upcoming(now)
+    previous_table = timeline.previous(now)
+    assert [match["key"] for match in upcoming_table] == [match["key"] for match in upcoming_dicts(dicts, now)]
+    assert [match["key"] for match in previous_table] == [match["key"] for match in previous_dicts(dicts, now)]
+    assert (format.format_matches(upcoming_table[:MATCHES_PER_PAGE], "Matches", 254).to_dict()
+            == format.format_matches(upcoming_dicts(dicts, now)[:MATCHES_PER_PAGE], "Matches", 254).to_dict())
+
+    benchmarks = {
+        "upcoming": (lambda: upcoming_dicts(dicts, now), lambda: timeline.upcoming(now)),
+        "previous": (lambda: previous_dicts(dicts, now), lambda: timeline.previous(now)),
+        "page": (lambda: format.format_matches(upcoming_dicts(dicts, now)[:MATCHES_PER_PAGE], "Matches", 254),
+                 lambda: format.format_matches(timeline.upcoming(now)[:MATCHES_PER_PAGE], "Matches", 254)),
+    }
+    for name, (with_dicts, with_timeline) in benchmarks.items():
+        dicts_seconds = min(timeit.repeat(with_dicts, number=1, repeat=repeats))
+        timeline_seconds = min(timeit.repeat(with_timeline, number=1, repeat=repeats))
+        print(f"{name:>16}: dicts {dicts_seconds * 1000:.2f} ms, timeline {timeline_seconds * 1000:.2f} ms "
+              f"({dicts_seconds / timeline_seconds:.2f}x)")
+
+    timeline_seconds = min(timeit.repeat(lambda: TeamTimeline().update(table), number=1, repeat=repeats))
+    print(f"{'build timeline':>16}: {timeline_seconds * 1000:.2f} ms")
+
+    build_seconds = min(timeit.repeat(lambda: MatchTable.from_matches(dicts), number=1, repeat=repeats))
+    print(f"{'build table':>16}: {build_seconds * 1000:.2f} ms")
+
+    asyncio.run(check_webhook_refresh(season))
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:3]))
@@ -0,0 +1,163 @@
+"""Benchmark of EventStats on a synthetic event, adding one played match at a time.
+
+Compares keeping the ratings up to date with rank-one updates against refitting them from scratch after
+every match, and checks both against NumPy's least-squares solver. Also checks the ratings against the
+OPRs TBA published for every event recorded in the fixtures directory; ``--record`` first fetches an
+event's matches and OPRs from the real API into it, which needs ``TBA_API_KEY``.
+
+Usage: python -m benchmarks.bench_opr [number of teams] [number of quals] [repeats]
+       python -m benchmarks.bench_opr --record --event 2023onto
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import timeit
+from pathlib import Path
+
+import numpy as np
+
+from audeamus_bot.analytics.opr import EventStats, match_row
+from audeamus_bot.types.tba_types import MatchSimple
+from benchmarks.tba_standin import TBAStandIn
+
+FIXTURES_DIR = os.path.join("benchmarks", "fixtures")
+
+
+def synthetic_event(num_teams: int, num_quals: int, seed: int = 0) -> list[MatchSimple]:
+    """Generates an event's qualification matches, scored from hidden per-team contributions plus noise."""
+    rng = random.Random(seed)
+    teams = [f"frc{number}" for number in rng.sample(range(1, 9999), num_teams)]
+    offense = {team_key: rng.uniform(0, 40) for team_key in teams}
+    defense = {team_key: rng.uniform(0, 10) for team_key in teams}
+
+    matches: list[MatchSimple] = []
+    for number in range(1, num_quals + 1):
+        alliance_teams = rng.sample(teams, 6)
+        red, blue = alliance_teams[:3], alliance_teams[3:]
+        red_score = round(sum(offense[team] for team in red) - sum(defense[team] for team in blue)
+                          + rng.gauss(0, 8))
+        blue_score = round(sum(offense[team] for team in blue) - sum(defense[team] for team in red)
+                           + rng.gauss(0, 8))
+        matches.append({
+            "key": f"2023ev_qm{number}", "comp_level": "qm", "set_number": 1, "match_number": number,
+            "alliances": {"red": {"score": max(red_score, 0), "team_keys": red,
+                                  "surrogate_team_keys": [], "dq_team_keys": []},
+                          "blue": {"score": max(blue_score, 0), "team_keys": blue,
+                                   "surrogate_team_keys": [], "dq_team_keys": []}},
+            "winning_alliance": "red" if red_score > blue_score else "blue", "event_key": "2023ev",
+            "time": None, "predicted_time": None, "actual_time": None,
+        })
+    return matches
+
+
+def least_squares(matches: list[MatchSimple]) -> dict[str, dict[str, float]]:
+    """Solves for the ratings with numpy.linalg.lstsq, as a reference."""
+    rows = [row for row in map(match_row, matches) if row is not None]
+    teams = sorted({team_key for red, blue, _, _ in rows for team_key in red + blue})
+    indices = {team_key: i for i, team_key in enumerate(teams)}
+    incidence = np.zeros((2 * len(rows), len(teams)))
+    scores = np.zeros((2 * len(rows), 2))
+    for i, (red, blue, red_score, blue_score) in enumerate(rows):
+        incidence[2 * i, [indices[team_key] for team_key in red]] = 1
+        incidence[2 * i + 1, [indices[team_key] for team_key in blue]] = 1
+        scores[2 * i], scores[2 * i + 1] = (red_score, blue_score), (blue_score, red_score)
+
+    ratings = np.linalg.lstsq(incidence, scores, rcond=None)[0]
+    return {"oprs": dict(zip(teams, ratings[:, 0])), "dprs": dict(zip(teams, ratings[:, 1])),
+            "ccwms": dict(zip(teams, ratings[:, 0] - ratings[:, 1]))}
+
+
+def max_difference(ratings: dict[str, dict[str, float]], reference: dict[str, dict[str, float]]) -> float:
+    return max(abs(ratings[stat][team_key] - value)
+               for stat in ("oprs", "dprs", "ccwms") for team_key, value in reference[stat].items())
+
+
+def incremental(matches: list[MatchSimple]) -> EventStats:
+    stats = EventStats()
+    for played in range(1, len(matches) + 1):
+        stats.update(matches[:played])
+    return stats
+
+
+def refit_every_match(matches: list[MatchSimple]) -> EventStats:
+    for played in range(1, len(matches) + 1):
+        stats = EventStats()
+        stats.update(matches[:played])
+    return stats  # type: ignore
+
+
+def check_fixtures(fixtures_dir: str, event_key: str):
+    """Checks the ratings against the OPRs TBA published for the event."""
+    event_dir = Path(fixtures_dir, "event", event_key)
+    matches = json.loads(Path(event_dir, "matches", "simple.json").read_text())
+    published = json.loads(Path(event_dir, "oprs.json").read_text())
+
+    stats = EventStats()
+    stats.update(matches)
+    difference = max_difference(stats.oprs(), published)  # type: ignore
+    print(f"{event_key}: {len(stats)} matches, {len(stats.teams)} teams, "
+          f"largest difference from TBA {difference:.4f}")
+    assert difference < 0.01
+
+
+async def record_event(fixtures_dir: str, event_key: str):
+    """Saves the event's matches and TBA's OPRs to the fixtures, fetching them from the real API."""
+    standin = TBAStandIn(fixtures_dir, record=True)
+    for path in (f"/event/{event_key}/matches/simple", f"/event/{event_key}/oprs"):
+        if not await standin.load(path):
+            raise FileNotFoundError(f"Could not record {path}; check TBA_API_KEY and the event key")
+
+
+def recorded_events(fixtures_dir: str) -> list[str]:
+    """Gets the events in the fixtures with both their matches and TBA's OPRs recorded."""
+    return sorted(event_dir.name for event_dir in Path(fixtures_dir, "event").glob("*")
+                  if Path(event_dir, "oprs.json").is_file() and Path(event_dir, "matches", "simple.json").is_file())
+
+
+def main(num_teams: int = 64, num_quals: int = 128, repeats: int = 5):
+    matches = synthetic_event(num_teams, num_quals)
+    print(f"{num_teams} teams, {num_quals} matches")
+
+    # The ridge term moves the ratings by about a millionth of a point
+    reference = least_squares(matches)
+    incremental_difference = max_difference(incremental(matches).oprs(), reference)
+    refit_difference = max_difference(refit_every_match(matches).oprs(), reference)
+    print(f"{'lstsq difference':>20}: rank-one {incremental_difference:.1e}, refit {refit_difference:.1e}")
+    assert incremental_difference < 1e-4 and refit_difference < 1e-4
+
+    last_match_times = []
+    for _ in range(repeats):
+        stats = EventStats()
+        stats.update(matches[:-1])
+        start = time.perf_counter()
+        stats.update(matches)
+        last_match_times.append(time.perf_counter() - start)
+    incremental_seconds = min(timeit.repeat(lambda: incremental(matches), number=1, repeat=repeats))
+    refit_seconds = min(timeit.repeat(lambda: refit_every_match(matches), number=1, repeat=repeats))
+    print(f"{'one new match':>20}: {min(last_match_times) * 1000:.3f} ms")
+    print(f"{'whole event':>20}: rank-one {incremental_seconds * 1000:.1f} ms, refit every match "
+          f"{refit_seconds * 1000:.1f} ms ({refit_seconds / incremental_seconds:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("sizes", nargs="*", type=int, help="number of teams, number of quals and repeats")
+    parser.add_argument("--fixtures", default=FIXTURES_DIR, help="the recorded fixtures to check TBA's OPRs against")
+    parser.add_argument("--event", help="only check this event")
+    parser.add_argument("--record", action="store_true", help="record the event from the real API first")
+    args = parser.parse_args()
+    if args.record:
+        asyncio.run(record_event(args.fixtures, args.event))
+    if args.event is None:
+        main(*args.sizes)
+    event_keys = [args.event] if args.event is not None else recorded_events(args.fixtures)
+    if len(event_keys) == 0:
+        # Agreement with lstsq on synthetic events does not show agreement with TBA's published ratings
+        sys.exit(f"No events recorded in {args.fixtures}, so the ratings were not checked against TBA's; "
+                 "record one with --record --event <key>")
+    for event_key in event_keys:
+        check_fixtures(args.fixtures, event_key)
@@ -0,0 +1,324 @@
+"""Load test of the FRC slash commands against the local TBA stand-in.
+
+Runs the ``FRCCommands`` callbacks with fake interactions under a configurable concurrency and
+command mix, and reports latency percentiles per command, TBA requests per command, cache hit
+ratios and event loop lag. Results can be saved as a baseline and later runs compared against it.
+
+Usage:
+    python -m benchmarks.load_test --commands 2000 --concurrency 50 --latency 0.1
+    python -m benchmarks.load_test --save-baseline baseline.json
+    python -m benchmarks.load_test --baseline baseline.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Optional
+
+import discord
+
+from audeamus_bot.analytics.simulation import RankingSimulator
+from audeamus_bot.api.tba_api import TBAClient
+from audeamus_bot.commands.frc_commands import FRCCommands
+from benchmarks.tba_standin import TBAStandIn
+
+DEFAULT_MIX = "schedule=4,history=2,event_rankings=3,tierlist=2,predictions=2,district_rankings=1,events=1"
+
+
+def populate(standin: TBAStandIn, year: int, num_events: int = 4, teams_per_event: int = 40,
+             quals_per_event: int = 80, seed: int = 0) -> dict[str, list]:
+    """Serves a synthetic season with events in progress around the current time.
+
+    Returns:
+        The team numbers, event keys and district key to run commands for
+    """
+    rng = random.Random(seed)
+    now = int(time.time())
+    team_numbers = rng.sample(range(1, 9999), teams_per_event * 2)
+    team_matches: dict[str, list] = defaultdict(list)
+    team_events: dict[str, list] = defaultdict(list)
+    event_keys = []
+
+    for event in range(num_events):
+        event_key = f"{year}ev{event}"
+        event_keys.append(event_key)
+        teams = [f"frc{number}" for number in rng.sample(team_numbers, teams_per_event)]
+        event_info = {"key": event_key, "name": f"Event {event}", "event_code": f"ev{event}",
+                      "start_date": f"{year}-03-01", "end_date": f"{year}-03-03", "week": event}
+
+        matches, match_predictions = [], {}
+        for number in range(1, quals_per_event + 1):
+            key = f"{event_key}_qm{number}"
+            predicted_time = now + (number - quals_per_event // 2) * 420
+            played = predicted_time < now
+            alliance_teams = rng.sample(teams, 6)
+            red_score, blue_score = (rng.randint(20, 150), rng.randint(20, 150)) if played else (-1, -1)
+            match = {
+                "key": key, "comp_level": "qm", "set_number": 1, "match_number": number,
+                "alliances": {"red": {"score": red_score, "team_keys": alliance_teams[:3]},
+                              "blue": {"score": blue_score, "team_keys": alliance_teams[3:]}},
+                "winning_alliance": ("red" if red_score > blue_score else "blue") if played else "",
+                "event_key": event_key, "time": predicted_time, "predicted_time": predicted_time,
+                "actual_time": predicted_time if played else None,
+            }
+            matches.append(match)
+            for team_key in alliance_teams:
+                team_matches[team_key].append(match)
+
+            red, blue = rng.uniform(20, 150), rng.uniform(20, 150)
+            match_predictions[key] = {"red": {"score": red}, "blue": {"score": blue}, "prob": 0.5,
+                                      "winning_alliance": "red" if red > blue else "blue"}
+
+        for team_key in teams:
+            team_events[team_key].append(event_info)
+
+        standin.set_fixture(f"/event/{event_key}/matches/simple", matches)
+        standin.set_fixture(f"/event/{event_key}/teams/keys", teams)
+        standin.set_fixture(f"/event/{event_key}/predictions", {
+            "match_predictions": {"qual": match_predictions, "playoff": {}},
+            "ranking_predictions": [[team_key, [0, 0, 0, 0, rng.uniform(10, 40)]] for team_key in teams],
+        })
+        standin.set_fixture(f"/event/{event_key}/oprs", {
+            stat: {team_key: rng.uniform(-20, 60) for team_key in teams} for stat in ("oprs", "dprs", "ccwms")})
+        standin.set_fixture(f"/event/{event_key}/rankings", {"rankings": [
+            {"team_key": team_key, "rank": rank, "sort_orders": [rng.uniform(0, 4)], "matches_played": 6,
+             "record": {"wins": (wins := rng.randint(0, 6)), "losses": 6 - wins, "ties": 0}}
+            for rank, team_key in enumerate(teams, start=1)]})
+
+    for team_key, matches in team_matches.items():
+        standin.set_fixture(f"/team/{team_key}/matches/{year}/simple", matches)
+        standin.set_fixture(f"/team/{team_key}/events/{year}", team_events[team_key])
+        standin.set_fixture(f"/team/{team_key}/events/{year}/statuses", {
+            event["key"]: {"qual": {"ranking": {"rank": rng.randint(1, teams_per_event)}}}
+            for event in team_events[team_key]})
+
+    district_key = f"{year}dst"
+    standin.set_fixture(f"/district/{district_key}/rankings", [
+        {"team_key": f"frc{number}", "rank": rank, "point_total": rng.randint(0, 200)}
+        for rank, number in enumerate(team_numbers, start=1)])
+
+    return {"team_numbers": [int(team_key[3:]) for team_key in team_matches],
+            "event_keys": event_keys, "district_keys": [district_key]}
+
+
+class FakeResponse:
+    def __init__(self, interaction: "FakeInteraction"):
+        self.interaction = interaction
+        self.done = False
+
+    def is_done(self) -> bool:
+        return self.done
+
+    async def defer(self, **kwargs):
+        self.done = True
+        self.interaction.deferred = True
+
+    async def send_message(self, *args, **kwargs):
+        self.done = True
+        self.interaction.finish()
+
+    async def edit_message(self, **kwargs):
+        self.done = True
+
+
+class FakeFollowup:
+    def __init__(self, interaction: "FakeInteraction"):
+        self.interaction = interaction
+
+    async def send(self, *args, **kwargs):
+        self.interaction.finish()
+
+
+class FakeInteraction:
+    """Stands in for a discord.Interaction, recording when the command's final reply was sent."""
+
+    def __init__(self, command: Any):
+        self.command = command
+        self.extras: dict[str, Any] = {}
+        self.created_at = discord.utils.utcnow()
+        self.started = time.perf_counter()
+        self.latency: Optional[float] = None
+        self.deferred = False
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+    def finish(self):
+        self.latency = time.perf_counter() - self.started
+
+    async def edit_original_response(self, **kwargs):
+        # Commands that show partial results finish with their last edit
+        self.finish()
+
+
+def command_args(name: str, targets: dict[str, list], year: int, rng: random.Random) -> tuple:
+    if name in ("schedule", "history", "events"):
+        return rng.choice(targets["team_numbers"]), year
+    elif name == "district_rankings":
+        return rng.choice(targets["district_keys"]),
+    elif name == "compare":
+        return "", rng.choice(targets["event_keys"])
+    else:
+        return rng.choice(targets["event_keys"]),
+
+
+async def measure_loop_lag(lags: list[float], interval: float = 0.01):
+    """Records how late the event loop wakes up a task that sleeps for the interval."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    if len(values) == 0:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run(num_commands: int, concurrency: int, mix: dict[str, float], latency: float,
+              jitter: float, error_rate: float, max_age: int, seed: int,
+              compact_matches: bool = False) -> dict[str, Any]:
+    rng = random.Random(seed)
+    year = datetime.now().year
+    standin = TBAStandIn(max_age=max_age, latency=latency, jitter=jitter, error_rate=error_rate, seed=seed)
+    targets = populate(standin, year, seed=seed)
+    base_url = await standin.start(port=0)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        tba = TBAClient(api_key="load-test", base_url=base_url, cache_name=str(Path(cache_dir, "api_cache")),
+                        compact_matches=compact_matches)
+        bot = SimpleNamespace(tba=tba, metrics=tba.metrics, simulator=RankingSimulator())
+        commands = FRCCommands(bot, targets["team_numbers"][0], 8)  # type: ignore
+
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        latencies: dict[str, list[float]] = defaultdict(list)
+        errors: dict[str, int] = defaultdict(int)
+        deferred: dict[str, int] = defaultdict(int)
+        lags: list[float] = []
+        remaining = iter(range(num_commands))
+
+        async def worker():
+            for _ in remaining:
+                name = rng.choices(names, weights)[0]
+                command = commands.get_command(name)
+                interaction = FakeInteraction(command)
+                try:
+                    await command.callback(commands, interaction, *command_args(name, targets, year, rng))
+                except Exception:
+                    errors[name] += 1
+                    continue
+                latencies[name].append(interaction.latency)
+                deferred[name] += interaction.deferred
+
+        lag_task = asyncio.create_task(measure_loop_lag(lags))
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        duration = time.perf_counter() - start
+        lag_task.cancel()
+
+        cache_stats = tba.response_cache.stats()
+        await tba.close()
+        bot.simulator.close()
+    await standin.stop()
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    lookups = cache_stats["hits"] + cache_stats["misses"]
+    return {
+        "commands": num_commands,
+        "duration": duration,
+        "throughput": num_commands / duration,
+        "latency": {name: {"count": len(values), "p50": percentile(values, 0.5), "p95": percentile(values, 0.95),
+                           "p99": percentile(values, 0.99), "deferred": deferred[name], "errors": errors[name]}
+                    for name, values in sorted(latencies.items())},
+        "overall": {"p50": percentile(all_latencies, 0.5), "p95": percentile(all_latencies, 0.95),
+                    "p99": percentile(all_latencies, 0.99)},
+        "tba_requests": sum(standin.requests.values()),
+        "tba_requests_per_command": sum(standin.requests.values()) / num_commands,
+        "tba_statuses": dict(standin.statuses),
+        "cache": {**cache_stats, "hit_ratio": cache_stats["hits"] / lookups if lookups else 0},
+        "loop_lag": {"p50": percentile(lags, 0.5), "p99": percentile(lags, 0.99), "max": max(lags, default=0)},
+    }
+
+
+def report(results: dict[str, Any]):
+    print(f"{results['commands']} commands in {results['duration']:.2f} s "
+          f"({results['throughput']:.0f} commands/s)")
+    print(f"{'command':>18} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'deferred':>9} {'errors':>7}")
+    for name, stats in {**results["latency"], "overall": results["overall"]}.items():
+        print(f"{name:>18} {stats.get('count', results['commands']):>6} {stats['p50'] * 1000:>8.1f} "
+              f"{stats['p95'] * 1000:>8.1f} {stats['p99'] * 1000:>8.1f} {stats.get('deferred', ''):>9} "
+              f"{stats.get('errors', ''):>7}")
+    print(f"TBA requests: {results['tba_requests']} ({results['tba_requests_per_command']:.3f} per command), "
+          f"statuses {results['tba_statuses']}")
+    print(f"Cache: {results['cache']['hits']} hits, {results['cache']['misses']} misses, "
+          f"{results['cache']['stale_hits']} stale hits, hit ratio {results['cache']['hit_ratio']:.1%}")
+    print(f"Event loop lag: p50 {results['loop_lag']['p50'] * 1000:.2f} ms, "
+          f"p99 {results['loop_lag']['p99'] * 1000:.2f} ms, max {results['loop_lag']['max'] * 1000:.2f} ms")
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any], tolerance: float) -> bool:
+    """Prints the change from the baseline and returns whether any tracked metric regressed beyond the tolerance."""
+    metrics = [(f"{name} p95", ["latency", name, "p95"]) for name in results["latency"]]
+    metrics += [("overall p50", ["overall", "p50"]), ("overall p95", ["overall", "p95"]),
+                ("overall p99", ["overall", "p99"]), ("TBA requests per command", ["tba_requests_per_command"]),
+                ("event loop lag p99", ["loop_lag", "p99"])]
+
+    regressed = False
+    print(f"Compared to baseline (tolerance {tolerance:.0%}):")
+    for label, keys in metrics:
+        current, previous = results, baseline
+        for key in keys:
+            current, previous = current.get(key, {}), previous.get(key, {})
+        if not isinstance(current, (int, float)) or not isinstance(previous, (int, float)) or previous == 0:
+            continue
+
+        change = (current - previous) / previous
+        flag = ""
+        if change > tolerance:
+            flag = "  REGRESSION"
+            regressed = True
+        print(f"{label:>30}: {previous:.4g} -> {current:.4g} ({change:+.1%}){flag}")
+    return regressed
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    return {name: float(weight) for name, weight in (item.split("=") for item in mix.split(","))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the FRC commands against the local TBA stand-in.")
+    parser.add_argument("--commands", type=int, default=1000, help="number of commands to run")
+    parser.add_argument("--concurrency", type=int, default=25, help="number of commands running at once")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="command weights, e.g. schedule=3,history=1")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds the stand-in delays responses by")
+    parser.add_argument("--jitter", type=float, default=0.05, help="maximum extra random delay in seconds")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of TBA requests that fail")
+    parser.add_argument("--max-age", type=int, default=60, help="Cache-Control max-age of TBA responses")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compact", action="store_true", help="keep matches in memory as MatchTables")
+    parser.add_argument("--save-baseline", help="file to save the results to as a baseline")
+    parser.add_argument("--baseline", help="baseline file to compare the results against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.commands, args.concurrency, parse_mix(args.mix), args.latency,
+                              args.jitter, args.error_rate, args.max_age, args.seed, args.compact))
+    report(results)
+
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps(results, indent=2))
+    if args.baseline and compare(results, json.loads(Path(args.baseline).read_text()), args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""A local stand-in for the TBA v3 API, serving recorded responses.
+
+Responses are read from JSON fixture files laid out like the API paths, e.g.
+``fixtures/event/2023onto/matches/simple.json`` for ``/event/2023onto/matches/simple``.
+Like TBA, every response has an ``ETag`` and a ``Cache-Control`` max-age, and requests with a
+matching ``If-None-Match`` get a 304. Latency and errors can be injected to exercise the caching path.
+
+In record mode, paths without a fixture are fetched from the real API and saved first.
+
+Usage:
+    python -m benchmarks.tba_standin --fixtures fixtures --port 8081 --latency 0.2 --error-rate 0.05
+    python -m benchmarks.tba_standin --fixtures fixtures --record
+
+Then point the bot at it with ``TBA_BASE_URL=http://localhost:8081/api/v3``.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+from collections import Counter
+from pathlib import Path
+from typing import Any, Optional
+
+import aiohttp
+from aiohttp import web
+
+from audeamus_bot.api.tba_api import TBA_API_KEY
+
+API_PREFIX = "/api/v3"
+
+UPSTREAM_URL = "https://www.thebluealliance.com/api/v3"
+
+
+class TBAStandIn:
+    """Serves TBA API responses from fixtures.
+
+    Args:
+        fixtures_dir: the directory of recorded responses
+        max_age: the ``Cache-Control`` max-age sent with every response
+        latency: seconds every response is delayed by
+        jitter: the maximum number of seconds randomly added to the latency
+        error_rate: the fraction of requests answered with a 503
+        record: whether to fetch and save paths without a fixture from the real API
+        upstream_url: the API to record from
+        api_key: the TBA API key to record with
+        seed: the seed for the latency and error randomness
+    """
+
+    def __init__(self, fixtures_dir: Optional[str] = None, max_age: int = 60, latency: float = 0,
+                 jitter: float = 0, error_rate: float = 0, record: bool = False,
+                 upstream_url: str = UPSTREAM_URL, api_key: Optional[str] = TBA_API_KEY,
+                 seed: Optional[int] = None):
+        self.fixtures_dir = Path(fixtures_dir) if fixtures_dir is not None else None
+        self.max_age = max_age
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.record = record
+        self.upstream_url = upstream_url
+        self.api_key = api_key
+        self.random = random.Random(seed)
+
+        # Response bodies and their ETags by path, loaded from the fixtures when first requested
+        self.bodies: dict[str, bytes] = {}
+        self.etags: dict[str, str] = {}
+
+        # Responses sent, by path and by status
+        self.requests: Counter[str] = Counter()
+        self.statuses: Counter[int] = Counter()
+
+        self.app = web.Application()
+        self.app.router.add_get("/__stats", self.handle_stats)
+        self.app.router.add_get(API_PREFIX + "/{path:.*}", self.handle)
+        self.runner: Optional[web.AppRunner] = None
+
+    def set_fixture(self, path: str, data: Any):
+        """Serves the data for the path, e.g. for synthetic load tests. Changing the data changes the ETag."""
+        self._set_body(path, json.dumps(data).encode())
+
+    def _set_body(self, path: str, body: bytes):
+        self.bodies[path] = body
+        self.etags[path] = f'W/"{hashlib.sha1(body).hexdigest()}"'
+
+    def _fixture_file(self, path: str) -> Path:
+        return self.fixtures_dir / (path.strip("/") + ".json")  # type: ignore
+
+    async def load(self, path: str) -> bool:
+        """Loads the path's fixture, recording it first in record mode, and gets whether it can be served."""
+        if path in self.bodies:
+            return True
+
+        if self.fixtures_dir is not None and self._fixture_file(path).is_file():
+            self._set_body(path, self._fixture_file(path).read_bytes())
+            return True
+
+        if self.record:
+            return await self._record(path)
+        return False
+
+    async def _record(self, path: str) -> bool:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(self.upstream_url + path, headers={"X-TBA-AUTH-KEY": self.api_key}) as response:
+                if response.status != 200:
+                    return False
+                body = await response.read()
+
+        if self.fixtures_dir is not None:
+            fixture_file = self._fixture_file(path)
+            fixture_file.parent.mkdir(parents=True, exist_ok=True)
+            fixture_file.write_bytes(body)
+        self._set_body(path, body)
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        path = "/" + request.match_info["path"]
+        self.requests[path] += 1
+
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if self.random.random() < self.error_rate:
+            response = web.Response(status=503, text="Injected error")
+        elif not await self.load(path):
+            response = web.json_response({"Errors": [{"path": "Not found"}]}, status=404)
+        else:
+            headers = {"ETag": self.etags[path], "Cache-Control": f"public, max-age={self.max_age}"}
+            if request.headers.get("If-None-Match") == self.etags[path]:
+                response = web.Response(status=304, headers=headers)
+            else:
+                response = web.Response(body=self.bodies[path], content_type="application/json", headers=headers)
+
+        self.statuses[response.status] += 1
+        return response
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"requests": self.requests, "statuses": self.statuses})
+
+    def reset_stats(self):
+        self.requests.clear()
+        self.statuses.clear()
+
+    async def start(self, host: str = "localhost", port: int = 8081) -> str:
+        """Starts serving and returns the base URL to give the TBAClient."""
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        # The port may have been picked by the OS
+        port = self.runner.addresses[0][1]
+        return f"http://{host}:{port}{API_PREFIX}"
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+async def _serve(args: argparse.Namespace):
+    standin = TBAStandIn(args.fixtures, max_age=args.max_age, latency=args.latency, jitter=args.jitter,
+                         error_rate=args.error_rate, record=args.record, seed=args.seed)
+    base_url = await standin.start(args.host, args.port)
+    print(f"Serving the TBA API at {base_url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await standin.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve recorded TBA API responses locally.")
+    parser.add_argument("--fixtures", default=os.path.join("benchmarks", "fixtures"),
+                        help="directory of recorded responses")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--max-age", type=int, default=60, help="Cache-Control max-age of responses")
+    parser.add_argument("--latency", type=float, default=0, help="seconds to delay every response by")
+    parser.add_argument("--jitter", type=float, default=0, help="maximum extra random delay in seconds")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of requests that fail with a 503")
+    parser.add_argument("--record", action="store_true", help="fetch and save missing paths from the real API")
+    parser.add_argument("--seed", type=int, default=None)
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass